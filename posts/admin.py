@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import search
 from .models import Post, Group, Comment, Follow
 
 
@@ -9,6 +10,13 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",) 
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        # вместо LIKE '%...%' по тексту ищем по индексу FTS5
+        if not search_term or not search.is_available():
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        return search.filter_matching(queryset, search_term), False
+
 
 admin.site.register(Post, PostAdmin)
 
@@ -0,0 +1,270 @@
+import json
+import random
+import re
+import time
+from contextlib import contextmanager
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from .models import Comment, Follow, Group, Post, TimelineEntry
+from .paginators import CursorPaginator
+from .rendering import render_stored_html
+from .stats import actual_comment_count, rebuild_stats
+from .views import COMMENTS_ORDERING, COMMENTS_PER_PAGE
+
+
+User = get_user_model()
+
+# полный проход по таблице и сортировка во временном B-дереве —
+# признаки того, что запрос ленты перестал попадать в индекс; проход по
+# subquery — это чтение уже ограниченной LIMIT выборки при count()
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(?!subquery$)\w+( AS \w+)?$")
+TEMP_SORT = re.compile(r"USE TEMP B-TREE")
+CURSOR_LINK = re.compile(r'href="([^"?]*)\?cursor=([\w-]+)"')
+
+
+def seed_images(post_ids, count, rnd):
+    """Сохраняет count картинок и раздаёт их случайным постам."""
+    for number, post_id in enumerate(rnd.sample(post_ids,
+                                                min(count, len(post_ids)))):
+        color = tuple(rnd.randrange(256) for _ in range(3))
+        content = BytesIO()
+        Image.new("RGB", (1280, 720), color).save(content, "JPEG")
+        name = default_storage.save(f"posts/bench_{number}.jpg",
+                                    ContentFile(content.getvalue()))
+        # миниатюры готовит thumbnail_worker, как для обычной загрузки
+        Post.objects.filter(pk=post_id).update(image=name,
+                                               thumbnail_ready=False)
+
+
+def seeded_users():
+    return User.objects.filter(username__startswith="bench_user_")
+
+
+def seeded_groups():
+    return Group.objects.filter(slug__startswith="bench-group-")
+
+
+def flush_dataset():
+    """Удаляет данные seed_dataset: посты, комментарии и подписки
+    удаляются каскадом вместе с пользователями."""
+    seeded_users().delete()
+    seeded_groups().delete()
+
+
+def seed_dataset(users=100, groups=10, posts=10000, comments=20000,
+                 follows=1000, images=0, batch_size=None, seed=0):
+    rnd = random.Random(seed)
+    User.objects.bulk_create(
+        [User(username=f"bench_user_{number}")
+         for number in range(users)],
+        batch_size=batch_size)
+    user_ids = list(seeded_users().values_list("id", flat=True))
+    Group.objects.bulk_create(
+        [Group(title=f"Группа {number}",
+               slug=f"bench-group-{number}",
+               description="Группа для нагрузочного теста")
+         for number in range(groups)],
+        batch_size=batch_size)
+    group_ids = list(seeded_groups().values_list("id", flat=True))
+    Post.objects.bulk_create(
+        [Post(text=f"Пост {number} для нагрузочного теста",
+              author_id=rnd.choice(user_ids),
+              group_id=rnd.choice(group_ids + [None]))
+         for number in range(posts)],
+        batch_size=batch_size)
+    post_ids = list(Post.objects.filter(
+        author_id__in=user_ids).values_list("id", flat=True))
+    Comment.objects.bulk_create(
+        [Comment(post_id=rnd.choice(post_ids),
+                 author_id=rnd.choice(user_ids),
+                 text=f"Комментарий {number}")
+         for number in range(comments)],
+        batch_size=batch_size)
+    pairs = set()
+    while len(pairs) < min(follows, len(user_ids) * (len(user_ids) - 1)):
+        user_id, author_id = rnd.sample(user_ids, 2)
+        pairs.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in pairs],
+        batch_size=batch_size)
+    # bulk_create не вызывает сигналы, поэтому ленты и счётчики
+    # заполняем вручную
+    for user_id, author_id in pairs:
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id,
+                           post_id=post_id,
+                           author_id=author_id,
+                           pub_date=pub_date)
+             for post_id, pub_date in Post.objects.filter(
+                 author_id=author_id).values_list("id", "pub_date")],
+            batch_size=batch_size)
+    Post.objects.filter(author_id__in=user_ids).update(
+        comment_count=actual_comment_count())
+    seed_images(post_ids, images, rnd)
+    render_stored_html(Post, batch_size or 1000)
+    render_stored_html(Comment, batch_size or 1000)
+    rebuild_stats(user_ids)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def view_urls():
+    """Адреса страниц, запросы которых проверяются на план выполнения."""
+    follow = Follow.objects.order_by("id").first()
+    post = Post.objects.order_by("-comment_count").first()
+    group = Group.objects.filter(posts__isnull=False).first()
+    return follow.user, {
+        "index": reverse("index"),
+        "group": reverse("group", args=[group.slug]),
+        "profile": reverse("profile", args=[post.author.username]),
+        "post": reverse("post", args=[post.author.username, post.id]),
+        "follow_index": reverse("follow_index"),
+    }
+
+
+def explain(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@contextmanager
+def captured_selects():
+    """Собирает SELECT вместе с параметрами.
+
+    CaptureQueriesContext подставляет значения в текст запроса, а с
+    константами SQLite может выбрать другой план, чем для параметров.
+    """
+    selects = []
+
+    def record(execute, sql, params, many, context):
+        if sql.startswith("SELECT"):
+            selects.append((sql, tuple(params or ())))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        yield selects
+
+
+def plan_problems(plan):
+    return [line for line in plan
+            if FULL_SCAN.search(line) or TEMP_SORT.search(line)]
+
+
+def cursor_links(url, response):
+    """Адреса ссылок «?cursor=» со страницы: сначала назад, потом вперёд."""
+    return [(path or url, cursor) for path, cursor in
+            CURSOR_LINK.findall(response.content.decode())]
+
+
+def explain_views():
+    """Открывает каждую страницу и возвращает планы всех её SELECT.
+
+    Кроме первых двух страниц по номеру, проходит по курсорам вперёд и
+    назад: глубокие страницы лент открываются именно так.
+    """
+    user, urls = view_urls()
+    client = Client()
+    client.force_login(user)
+    plans = {}
+    for name, url in urls.items():
+        with captured_selects() as queries:
+            response = client.get(url)
+            client.get(url, {"page": 2})
+            for path, cursor in cursor_links(url, response)[-1:]:
+                response = client.get(path, {"cursor": cursor})
+                for path, cursor in cursor_links(path, response):
+                    client.get(path, {"cursor": cursor})
+        plans[name] = [(sql, explain(sql, params)) for sql, params in queries]
+    # у поста из небольшого набора может не набраться второй порции
+    # комментариев, поэтому курсор строим сами
+    post = Post.objects.order_by("-comment_count").first()
+    paginator = CursorPaginator(post.comments.all(), COMMENTS_PER_PAGE,
+                                COMMENTS_ORDERING)
+    newest = post.comments.order_by(*COMMENTS_ORDERING).first()
+    with captured_selects() as queries:
+        client.get(reverse("post_comments",
+                           args=[post.author.username, post.id]),
+                   {"cursor": paginator.cursor_after(newest)})
+    plans["post_comments"] = [(sql, explain(sql, params))
+                              for sql, params in queries]
+    return plans
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = round(percent / 100 * (len(values) - 1))
+    return values[index]
+
+
+def measure(request, repeat):
+    """Выполняет запрос repeat раз, возвращает время в мс и число SQL."""
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured.captured_queries))
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.request['PATH_INFO']} "
+                               f"вернул {response.status_code}")
+    return {
+        "repeat": repeat,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p90_ms": round(percentile(timings, 90), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "queries": max(queries),
+    }
+
+
+def benchmark_views(repeat=50, warmup=5):
+    """Замеряет задержку и число запросов к базе для страниц yatube."""
+    user, urls = view_urls()
+    post = Post.objects.order_by("-comment_count").first()
+    client = Client()
+    client.force_login(user)
+    requests = {name: (lambda url=url: client.get(url))
+                for name, url in urls.items()}
+    requests["new_post"] = lambda: client.post(
+        reverse("new_post"), {"text": "Пост из нагрузочного теста"})
+    requests["add_comment"] = lambda: client.post(
+        reverse("add_comment", args=[post.author.username, post.id]),
+        {"text": "Комментарий из нагрузочного теста"})
+    results = {}
+    for name, request in requests.items():
+        for _ in range(warmup):
+            request()
+        results[name] = measure(request, repeat)
+    return results
+
+
+def compare_results(old, new):
+    """Строки вида «view: метрика было -> стало (изменение)»."""
+    lines = []
+    for name, metrics in new.items():
+        if name not in old:
+            continue
+        for metric in ("p50_ms", "p90_ms", "queries"):
+            before, after = old[name][metric], metrics[metric]
+            change = (after - before) / before * 100 if before else 0
+            lines.append(f"{name}: {metric} {before} -> {after} "
+                         f"({change:+.1f}%)")
+    return lines
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as results_file:
+        return json.load(results_file)["views"]
@@ -0,0 +1,203 @@
+import datetime as dt
+import hashlib
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+
+from .models import Group
+
+
+def generation_key(name):
+    return f"generation:{name}"
+
+
+def new_generation():
+    # поколение берём из текущего времени, чтобы после вытеснения ключа
+    # из кэша старые значения не повторились
+    return int(time.time() * 1000)
+
+
+def get_generation(name):
+    key = generation_key(name)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, new_generation(), None)
+        generation = cache.get(key, new_generation())
+    return generation
+
+
+def bump_generation(*names):
+    for name in names:
+        key = generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, new_generation(), None)
+
+
+def group_generation_name(group_id):
+    return f"group:{group_id}"
+
+
+def author_generation_name(user_id):
+    return f"author:{user_id}"
+
+
+def group_id_key(slug):
+    return f"group-id:{slug}"
+
+
+def group_id_for_slug(slug):
+    group_id = cache.get(group_id_key(slug))
+    if group_id is None:
+        group_id = Group.objects.filter(slug=slug).values_list(
+            "id", flat=True).first() or 0
+        # найденный id обновляет posts.signals, промах живёт недолго:
+        # группа могла появиться в обход save()
+        timeout = None if group_id else settings.GROUP_MISSING_TIMEOUT
+        cache.set(group_id_key(slug), group_id, timeout)
+    return group_id
+
+
+def flatpage_key(site_id, url):
+    # поколение flatpages увеличивается в posts.signals при любой правке
+    digest = hashlib.md5(url.encode()).hexdigest()
+    return f"flatpage:{site_id}:{digest}:{get_generation('flatpages')}"
+
+
+def make_etag(request, *parts):
+    """ETag страницы из версий данных и того, что зависит от посетителя.
+
+    В ключ входят адрес с параметрами, пользователь и его CSRF-секрет
+    (токен попадает в формы), а также год из подвала страницы.
+    """
+    viewer = csrf = ""
+    if request.user.is_authenticated:
+        viewer = request.user.pk
+        # get_token создаёт секрет при первом визите, чтобы ETag
+        # не менялся после установки cookie
+        get_token(request)
+        csrf = request.META["CSRF_COOKIE"]
+    raw = ":".join(map(str, [request.get_full_path(), *parts, viewer, csrf,
+                             dt.datetime.now().year]))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def lock_key(key):
+    return f"{key}:lock"
+
+
+def acquire_lock(key):
+    """Берёт блокировку пересчёта key; возвращает токен или None.
+
+    cache.add атомарен, поэтому блокировку получает только один процесс.
+    Если он упадёт, блокировка истечёт через CACHE_LOCK_TIMEOUT секунд.
+    """
+    token = uuid.uuid4().hex
+    if cache.add(lock_key(key), token, settings.CACHE_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    if cache.get(lock_key(key)) == token:
+        cache.delete(lock_key(key))
+
+
+def get_or_compute(key, compute, timeout, beta=1.0, version=None):
+    """Значение из кэша или результат compute() без «эффекта толпы».
+
+    Вместе со значением хранится, сколько длился пересчёт, мягкий срок
+    жизни и version (например, поколение ленты); сама запись живёт ещё
+    CACHE_STALE_TIMEOUT секунд. Значение другой версии считается
+    истёкшим.
+
+    * Незадолго до срока значение пересчитывается заранее с
+      вероятностью, которая растёт к концу срока и с длительностью
+      пересчёта (XFetch), поэтому дорогие ключи обычно обновляются до
+      того, как истекут.
+    * Пересчитывает только процесс, взявший блокировку; остальные в это
+      время отдают устаревшее значение.
+    * Если значения нет совсем, остальные ждут его до CACHE_WAIT_TIMEOUT
+      секунд, а потом считают сами.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires, entry_version = entry
+        # 1 - random() лежит в (0, 1], логарифм не бывает бесконечным
+        early = delta * beta * math.log(1 - random.random())
+        if entry_version == version and time.time() - early < expires:
+            return value
+        token = acquire_lock(key)
+        if token is None:
+            return value
+    else:
+        token = acquire_lock(key)
+        if token is None:
+            entry = wait_for(key)
+            if entry is not None:
+                return entry[0]
+    try:
+        started = time.time()
+        value = compute()
+        finished = time.time()
+        cache.set(key,
+                  (value, finished - started, finished + timeout, version),
+                  timeout + settings.CACHE_STALE_TIMEOUT)
+        return value
+    finally:
+        if token is not None:
+            release_lock(key, token)
+
+
+def wait_for(key):
+    deadline = time.time() + settings.CACHE_WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(settings.CACHE_WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(lock_key(key)) is None:
+            # пересчитывавший процесс сдался, дальше считаем сами
+            return None
+    return None
+
+
+# признак небольшой ленты в кэше: её число записей считается точно
+SMALL_FEED = -1
+
+
+def feed_count(key, queryset, estimate=None):
+    """Число записей ленты для Paginator без COUNT(*) по всей таблице.
+
+    Небольшие ленты считаются точно: подсчёт ограничен
+    FEED_COUNT_EXACT_LIMIT строками. Для больших берётся оценка
+    (или точный подсчёт, если оценки нет) и кэшируется на
+    FEED_COUNT_TIMEOUT секунд через get_or_compute; неточность касается
+    только последних страниц.
+    """
+    limit = settings.FEED_COUNT_EXACT_LIMIT
+    counted = None
+
+    def count_feed():
+        nonlocal counted
+        counted = queryset.order_by()[:limit + 1].count()
+        if counted <= limit:
+            return SMALL_FEED
+        return estimate() if estimate is not None else queryset.count()
+
+    count = get_or_compute(key, count_feed, settings.FEED_COUNT_TIMEOUT)
+    if count != SMALL_FEED:
+        return count
+    if counted is None:
+        counted = queryset.order_by()[:limit + 1].count()
+    if counted > limit:
+        # лента выросла с прошлого подсчёта
+        cache.delete(key)
+        return feed_count(key, queryset, estimate)
+    return counted
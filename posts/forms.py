@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth import get_user_model
 
 from .models import Post, Comment
+from .thumbnails import set_image_metadata
 
 
 User = get_user_model()
@@ -16,6 +17,11 @@ class PostForm(forms.ModelForm):
             'group': 'При необходимости, выберите группу'
         }
 
+    def save(self, commit=True):
+        if "image" in self.changed_data:
+            set_image_metadata(self.instance, self.cleaned_data["image"])
+        return super().save(commit)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
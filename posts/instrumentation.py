@@ -0,0 +1,96 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.template.backends.django import DjangoTemplates, Template
+from django.urls import get_resolver
+
+
+METRICS = ("requests", "queries", "db_us", "template_us", "total_us")
+
+# замеры текущего запроса; шаблоны рендерятся в том же потоке
+current = threading.local()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # обёртка для connection.execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = getattr(current, "timings", None)
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблонизатор Django, который замеряет время рендера для
+    posts.middleware.RequestTimingMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+def stats_key(url_name, metric):
+    return f"view-stats:{url_name}:{metric}"
+
+
+def record(url_name, timings, total_time):
+    values = {
+        "requests": 1,
+        "queries": timings.queries,
+        "db_us": int(timings.db_time * 1e6),
+        "template_us": int(timings.template_time * 1e6),
+        "total_us": int(total_time * 1e6),
+    }
+    for metric, value in values.items():
+        key = stats_key(url_name, metric)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            if not cache.add(key, value, None):
+                cache.incr(key, value)
+
+
+def view_stats():
+    """Средние значения по каждой странице, которую уже открывали."""
+    names = sorted(name for name in get_resolver().reverse_dict
+                   if isinstance(name, str))
+    values = cache.get_many([stats_key(name, metric)
+                             for name in names for metric in METRICS])
+    stats = {}
+    for name in names:
+        requests = values.get(stats_key(name, "requests"))
+        if not requests:
+            continue
+        totals = {metric: values.get(stats_key(name, metric), 0)
+                  for metric in METRICS}
+        stats[name] = {
+            "requests": requests,
+            "queries": round(totals["queries"] / requests, 2),
+            "db_ms": round(totals["db_us"] / requests / 1000, 3),
+            "template_ms": round(totals["template_us"] / requests / 1000, 3),
+            "total_ms": round(totals["total_us"] / requests / 1000, 3),
+        }
+    return stats
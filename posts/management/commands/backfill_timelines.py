@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.timeline import mark_celebrities, release_celebrities
+
+
+class Command(BaseCommand):
+    help = ("Переключает авторов между раскладкой постов по лентам и "
+            "чтением при запросе по числу подписчиков")
+
+    def handle(self, *args, **options):
+        marked = mark_celebrities()
+        released = release_celebrities()
+        self.stdout.write(f"Переведено на чтение при запросе: {marked}, "
+                          f"возвращено в ленты: {released}")
@@ -0,0 +1,90 @@
+import json
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from posts.benchmark import percentile
+
+
+BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "mmap": "yatube.mmap_cache.MmapCache",
+}
+
+
+def run_worker(args):
+    """Нагрузка одного воркера: чтение с дозаписью при промахе."""
+    backend, location, options, worker, ops, keys, value_size = args
+    cache = import_string(BACKENDS[backend])(location, {
+        "OPTIONS": options, "TIMEOUT": None})
+    rnd = random.Random(worker)
+    value = "x" * value_size
+    hits = 0
+    timings = []
+    for _ in range(ops):
+        # популярные ключи запрашиваются чаще, как страницы ленты
+        key = f"bench:{int(keys * rnd.random() ** 3)}"
+        started = time.perf_counter()
+        if cache.get(key) is None:
+            cache.set(key, value)
+        else:
+            hits += 1
+        timings.append((time.perf_counter() - started) * 1e6)
+    return hits, timings
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает LocMemCache и общий MmapCache при нескольких "
+            "процессах: доля попаданий и задержка операций")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--ops", type=int, default=20000,
+                            help="операций на воркер")
+        parser.add_argument("--keys", type=int, default=5000)
+        parser.add_argument("--value-size", type=int, default=1024)
+        parser.add_argument("--output", help="куда записать JSON")
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in BACKENDS:
+                if backend == "mmap":
+                    location = os.path.join(directory, "bench.mmap")
+                    cache_options = {"SIZE": 64 * 1024 * 1024,
+                                     "SLOTS": 65536}
+                else:
+                    # по умолчанию LocMemCache хранит лишь 300 ключей
+                    location = "benchmark"
+                    cache_options = {"MAX_ENTRIES": options["keys"] * 2}
+                jobs = [(backend, location, cache_options, worker,
+                         options["ops"], options["keys"],
+                         options["value_size"])
+                        for worker in range(options["workers"])]
+                started = time.perf_counter()
+                with Pool(options["workers"]) as pool:
+                    outcomes = pool.map(run_worker, jobs)
+                elapsed = time.perf_counter() - started
+                hits = sum(hit for hit, _ in outcomes)
+                timings = [value for _, worker_timings in outcomes
+                           for value in worker_timings]
+                results[backend] = {
+                    "workers": options["workers"],
+                    "hit_rate": round(hits / len(timings), 4),
+                    "p50_us": round(percentile(timings, 50), 2),
+                    "p99_us": round(percentile(timings, 99), 2),
+                    "ops_per_second": round(len(timings) / elapsed),
+                }
+        for backend, metrics in results.items():
+            self.stdout.write(
+                f"{backend:<7} попаданий {metrics['hit_rate']:.1%}  "
+                f"p50 {metrics['p50_us']} мкс  p99 {metrics['p99_us']} мкс  "
+                f"{metrics['ops_per_second']} оп/с")
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
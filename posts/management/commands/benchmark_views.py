@@ -0,0 +1,96 @@
+import json
+import subprocess
+import tempfile
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from posts.benchmark import (benchmark_views, compare_results, load_results,
+                             seed_dataset)
+
+
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark-views",
+    }
+}
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Создаёт тестовую базу, заполняет её данными и замеряет "
+            "задержку и число SQL-запросов основных страниц")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--groups", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=50000)
+        parser.add_argument("--comments", type=int, default=100000)
+        parser.add_argument("--follows", type=int, default=2000)
+        parser.add_argument("--images", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--output",
+                            help="куда записать результаты в JSON")
+        parser.add_argument("--compare",
+                            help="JSON предыдущего запуска для сравнения")
+
+    def handle(self, *args, **options):
+        dataset = {name: options[name] for name in (
+            "users", "groups", "posts", "comments", "follows", "images",
+            "seed")}
+        old_name = connection.settings_dict["NAME"]
+        # свой кэш: ключи карточек и пользователей зависят только от id,
+        # и записи из тестовой базы подменили бы на сайте настоящие
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root,
+                                  CACHES=BENCHMARK_CACHES):
+            connection.creation.create_test_db(verbosity=0,
+                                               autoclobber=True)
+            try:
+                seed_dataset(**dataset)
+                views = benchmark_views(options["repeat"], options["warmup"])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        results = {
+            "commit": current_commit(),
+            "created": timezone.now().isoformat(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "dataset": dataset,
+            "views": views,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+
+        for name, metrics in views.items():
+            self.stdout.write(
+                f"{name:<12} p50 {metrics['p50_ms']:>9} мс  "
+                f"p90 {metrics['p90_ms']:>9} мс  "
+                f"p99 {metrics['p99_ms']:>9} мс  "
+                f"SQL {metrics['queries']}")
+        if options["compare"]:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"Сравнение с {options['compare']}"))
+            for line in compare_results(load_results(options["compare"]),
+                                        views):
+                self.stdout.write(line)
+        if options["output"]:
+            self.stdout.write(self.style.SUCCESS(
+                f"Результаты записаны в {options['output']}"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from posts.benchmark import explain_views, plan_problems, seed_dataset
+
+
+class Command(BaseCommand):
+    help = ("Создаёт тестовую базу, заполняет её данными и проверяет "
+            "EXPLAIN QUERY PLAN для запросов каждой страницы")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--groups", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=50000)
+        parser.add_argument("--comments", type=int, default=100000)
+        parser.add_argument("--follows", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Команда рассчитана на EXPLAIN QUERY PLAN "
+                               "из SQLite")
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CACHES={"default": {
+                    "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+            }}):
+                seed_dataset(users=options["users"],
+                             groups=options["groups"],
+                             posts=options["posts"],
+                             comments=options["comments"],
+                             follows=options["follows"])
+                plans = explain_views()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        failures = []
+        for name, queries in plans.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for sql, plan in queries:
+                self.stdout.write(f"  {sql}")
+                for line in plan:
+                    self.stdout.write(f"    {line}")
+                failures.extend((name, sql, line)
+                                for line in plan_problems(plan))
+        if failures:
+            details = "\n".join(f"{name}: {line}\n  {sql}"
+                                for name, sql, line in failures)
+            raise CommandError(f"Запросы без индекса:\n{details}")
+        self.stdout.write(self.style.SUCCESS("Все запросы используют индексы"))
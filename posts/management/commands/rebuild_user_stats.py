@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.stats import rebuild_stats
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает UserStats для всех пользователей"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        user_ids = User.objects.order_by("pk").values_list("pk", flat=True)
+        total = 0
+        batch = []
+        for user_id in user_ids.iterator():
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                rebuild_stats(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            rebuild_stats(batch)
+            total += len(batch)
+        self.stdout.write(f"Пересчитана статистика пользователей: {total}")
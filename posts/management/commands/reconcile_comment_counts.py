@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from posts.models import Post
+from posts.stats import actual_comment_count
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает Post.comment_count, если счётчики разошлись"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        actual = actual_comment_count()
+        last_id = Post.objects.aggregate(last=Max("id"))["last"] or 0
+        fixed = 0
+        for start in range(0, last_id, batch_size):
+            batch = Post.objects.filter(id__gt=start,
+                                        id__lte=start + batch_size)
+            fixed += batch.exclude(comment_count=actual).update(
+                comment_count=actual)
+        self.stdout.write(f"Исправлено счётчиков: {fixed}")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Comment, Post
+from posts.rendering import render_stored_html
+from posts.signals import feeds_changed
+
+
+class Command(BaseCommand):
+    help = ("Перерисовывает сохранённый HTML постов и комментариев, "
+            "например после изменения posts.rendering")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        posts = render_stored_html(Post, batch_size)
+        comments = render_stored_html(Comment, batch_size)
+        if posts or comments:
+            # комментарии выводятся на страницах постов
+            feeds_changed(*Post.objects.values_list(
+                "group_id", flat=True).distinct())
+        self.stdout.write(f"Обновлено постов: {posts}, "
+                          f"комментариев: {comments}")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.benchmark import flush_dataset, seed_dataset, seeded_users
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу пользователями, группами, постами, "
+            "комментариями, подписками и картинками")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--groups", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=50000)
+        parser.add_argument("--comments", type=int, default=100000)
+        parser.add_argument("--follows", type=int, default=2000)
+        parser.add_argument("--images", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--flush", action="store_true",
+                            help="удалить данные прошлого запуска")
+
+    def handle(self, *args, **options):
+        if options["flush"]:
+            flush_dataset()
+        elif seeded_users().exists():
+            raise CommandError("Данные уже созданы, для повторного "
+                               "запуска добавьте --flush")
+        seed_dataset(users=options["users"],
+                     groups=options["groups"],
+                     posts=options["posts"],
+                     comments=options["comments"],
+                     follows=options["follows"],
+                     images=options["images"],
+                     seed=options["seed"])
+        self.stdout.write(self.style.SUCCESS("Данные созданы"))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.thumbnails import pending_posts, render_pending
+
+
+class Command(BaseCommand):
+    help = "Заранее готовит миниатюры загруженных картинок постов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=None)
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--interval", type=float, default=5.0)
+        parser.add_argument("--once", action="store_true",
+                            help="обработать очередь и завершиться")
+
+    def handle(self, *args, **options):
+        failed = set()
+        while True:
+            post_ids = list(pending_posts().exclude(pk__in=failed).order_by(
+                "pk").values_list("pk", flat=True)[:options["batch_size"]])
+            ready = render_pending(post_ids, options["processes"])
+            if post_ids:
+                self.stdout.write(
+                    f"Готово миниатюр: {ready} из {len(post_ids)}")
+            # не готовые после попытки (например, файл не найден)
+            # не берём повторно до перезапуска обработчика
+            failed.update(pending_posts().filter(
+                pk__in=post_ids).values_list("pk", flat=True))
+            if options["once"] and len(post_ids) < options["batch_size"]:
+                return
+            if not post_ids:
+                time.sleep(options["interval"])
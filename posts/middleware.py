@@ -0,0 +1,152 @@
+import datetime as dt
+import hashlib
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.cache import get_conditional_response
+from django.utils.http import urlencode
+
+from users.cache import get_user_by_username
+from . import instrumentation
+from .cache import (author_generation_name, get_generation, get_or_compute,
+                    group_generation_name, group_id_for_slug)
+from .paginators import decode_cursor
+
+
+class RequestTimingMiddleware:
+    """Считает SQL-запросы, время базы, рендера шаблонов и всего запроса.
+
+    Итоги отдаются в заголовке Server-Timing и копятся по имени адреса
+    (index, profile, post...) для страницы internal/stats/.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = instrumentation.RequestTimings()
+        instrumentation.current.timings = timings
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings):
+                response = self.get_response(request)
+        finally:
+            instrumentation.current.timings = None
+        total_time = time.perf_counter() - started
+        request.timings = timings
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={timings.db_time * 1000:.3f};'
+            f'desc="{timings.queries} queries"',
+            f"tpl;dur={timings.template_time * 1000:.3f}",
+            f"total;dur={total_time * 1000:.3f}",
+        ])
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            instrumentation.record(match.url_name, timings, total_time)
+        return response
+
+
+# параметры адреса, от которых зависят кэшируемые страницы
+CACHED_QUERY_PARAMS = ("page", "cursor")
+CACHED_PAGES = ("index", "group", "profile")
+
+
+class UncacheableResponse(Exception):
+    """Ответ представления, который нельзя класть в кэш."""
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.response = response
+
+
+class AnonymousPageCacheMiddleware:
+    """Отдаёт анонимным посетителям главную, группы и профили из кэша.
+
+    Страница кэшируется через posts.cache.get_or_compute с версией из
+    поколений ленты и автора; поколения увеличиваются в posts.signals
+    при изменении постов, комментариев и групп, поэтому явно удалять
+    страницы из кэша не нужно. После смены поколения страницу рендерит
+    один процесс, остальные до этого отдают её прошлую версию.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def page_version(self, url_name, view_kwargs):
+        """Поколения данных страницы или None, если её нет."""
+        if url_name == "group":
+            group_id = group_id_for_slug(view_kwargs["slug"])
+            return get_generation(group_generation_name(group_id))
+        generation = get_generation("posts")
+        if url_name == "profile":
+            author = get_user_by_username(view_kwargs["username"])
+            if author is None:
+                return None
+            return ":".join(map(str, [
+                generation,
+                get_generation(author_generation_name(author.pk))]))
+        return generation
+
+    def page_key(self, request, url_name):
+        year = dt.datetime.now().year
+        query = hashlib.md5(self.cached_query(request).encode()).hexdigest()
+        return ":".join(["page", url_name, request.path, query, str(year)])
+
+    def cached_query(self, request):
+        """Параметры, от которых зависит страница, или None.
+
+        Страницы с любыми другими параметрами не кэшируются, иначе
+        запросы вида ?x=<случайное> вытесняли бы из кэша нужные записи.
+        """
+        if set(request.GET) - set(CACHED_QUERY_PARAMS):
+            return None
+        params = []
+        for name in CACHED_QUERY_PARAMS:
+            values = request.GET.getlist(name)
+            if len(values) > 1:
+                return None
+            if values:
+                params.append((name, values[0]))
+        params = dict(params)
+        if not params.get("page", "1").isdigit():
+            return None
+        if "cursor" in params and decode_cursor(params["cursor"]) is None:
+            return None
+        return urlencode(params)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return None
+        url_name = request.resolver_match.url_name
+        if url_name not in CACHED_PAGES:
+            return None
+        if request.user.is_authenticated:
+            return None
+        if self.cached_query(request) is None:
+            return None
+        version = self.page_version(url_name, view_kwargs)
+        if version is None:
+            return None
+
+        def render_page():
+            response = view_func(request, *view_args, **view_kwargs)
+            # 304, 404, потоковые ответы и ответы с cookie (в том числе
+            # с CSRF-токеном посетителя) отдаются только этому запросу
+            if (response.status_code != 200 or response.streaming
+                    or response.cookies
+                    or request.META.get("CSRF_COOKIE_USED")):
+                raise UncacheableResponse(response)
+            return response
+
+        try:
+            response = get_or_compute(
+                self.page_key(request, url_name), render_page,
+                settings.ANONYMOUS_PAGE_CACHE_TIMEOUT, version=version)
+        except UncacheableResponse as uncacheable:
+            return uncacheable.response
+        return get_conditional_response(
+            request, etag=response.get("ETag"), response=response)
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.6 on 2026-10-18 17:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Post = apps.get_model('posts', 'Post')
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    def counted(model, field):
+        counts = model.objects.filter(**{field: OuterRef('pk')}).order_by(
+        ).values(field).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    users = User.objects.annotate(
+        posts_count=counted(Post, 'author'),
+        followers_count=counted(Follow, 'author'),
+        following_count=counted(Follow, 'user'),
+    ).values('pk', 'posts_count', 'followers_count', 'following_count')
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=row.pop('pk'), **row) for row in users.iterator()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0010_post_cache_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+                ('following_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
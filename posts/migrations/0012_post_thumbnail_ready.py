@@ -0,0 +1,26 @@
+# Generated by Django 2.2.6 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    # старые миниатюры уже создавались при показе страниц
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.exclude(image='').exclude(image__isnull=True).update(
+        thumbnail_ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from posts import search
+    search.install(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from posts import search
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    search.drop_triggers(connection)
+    if search.is_available(connection):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {search.FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_post_thumbnail_ready'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+from posts.rendering import render_stored_html
+
+
+def render_existing(apps, schema_editor):
+    render_stored_html(apps.get_model('posts', 'Post'))
+    render_stored_html(apps.get_model('posts', 'Comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
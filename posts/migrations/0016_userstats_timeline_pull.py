@@ -0,0 +1,27 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_celebrities(apps, schema_editor):
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.filter(
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT).update(
+        timeline_pull=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='timeline_pull',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .rendering import render_excerpt, render_text
+
 
 User = get_user_model()
 
@@ -14,8 +16,33 @@ class Group(models.Model):
         return self.title
 
 
+# поля, которые нужны карточке поста в лентах (includes/post_item.html)
+FEED_FIELDS = (
+    "id", "excerpt_html", "pub_date", "image", "thumbnail_ready",
+    "image_width", "image_height", "image_placeholder",
+    "comment_count", "cache_version",
+    "author", "author__id", "author__username",
+    "group", "group__id", "group__slug", "group__title",
+)
+
+
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        return self.select_related("author", "group").only(*FEED_FIELDS)
+
+
+def with_rendered_fields(update_fields, fields):
+    # при сохранении только части полей HTML пишется вместе с текстом
+    if update_fields is None or "text" not in update_fields:
+        return update_fields
+    return {*update_fields, *fields}
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name="Текст")
+    # HTML текста готовится при сохранении, шаблоны выводят его как есть
+    text_html = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
     pub_date = models.DateTimeField("date published", auto_now_add=True)
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
@@ -31,10 +58,43 @@ class Post(models.Model):
                               blank=True, null=True,
                               verbose_name="Изображение"
                               )
+    # сведения о картинке заполняются при загрузке (PostForm.save), чтобы
+    # шаблонам не нужно было открывать файл
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    image_format = models.CharField(max_length=10, blank=True,
+                                    editable=False)
+    image_size = models.PositiveIntegerField(null=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False)
+    # миниатюру готовит фоновый обработчик (manage.py thumbnail_worker),
+    # пока её нет, шаблоны показывают заглушку
+    thumbnail_ready = models.BooleanField(default=False, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # версия закэшированной карточки поста, см. includes/post_item.html
+    cache_version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='posts_post_feed_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='posts_post_author_feed_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='posts_post_group_feed_idx'),
+        ]
 
     def __str__(self):
         return self.text
 
+    def save(self, *args, update_fields=None, **kwargs):
+        self.text_html = render_text(self.text)
+        self.excerpt_html = render_excerpt(self.text_html)
+        update_fields = with_rendered_fields(
+            update_fields, ["text_html", "excerpt_html"])
+        super().save(*args, update_fields=update_fields, **kwargs)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post,
@@ -46,11 +106,23 @@ class Comment(models.Model):
                                related_name="comments"
                                )
     text = models.TextField(verbose_name="Текст комментария")
+    text_html = models.TextField(blank=True, editable=False)
     created = models.DateTimeField("date published", auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='posts_comment_post_feed_idx'),
+        ]
+
     def __str__(self):
         return self.text
 
+    def save(self, *args, update_fields=None, **kwargs):
+        self.text_html = render_text(self.text)
+        update_fields = with_rendered_fields(update_fields, ["text_html"])
+        super().save(*args, update_fields=update_fields, **kwargs)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User,
@@ -67,3 +139,48 @@ class Follow(models.Model):
 
     def __str__(self):
         return f"пользователь {self.user} подписан на {self.author}"
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="timeline",
+                             )
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="timeline_entries",
+                             )
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name="+",
+                               )
+    pub_date = models.DateTimeField("date published")
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='posts_timeline_feed_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='posts_timeline_author_idx'),
+        ]
+
+    def __str__(self):
+        return f"пост {self.post_id} в ленте пользователя {self.user_id}"
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="stats",
+                                )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # посты автора не раскладываются по лентам, а подтягиваются при
+    # чтении (posts.timeline); флаг снимает команда backfill_timelines
+    timeline_pull = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"статистика пользователя {self.user_id}"
@@ -0,0 +1,56 @@
+from django.db.models import F
+from django.template.defaultfilters import linebreaksbr
+from django.utils.text import Truncator
+
+
+# сколько слов поста показывать в карточке ленты
+EXCERPT_WORDS = 60
+
+
+def render_text(text):
+    """HTML текста: то же, что {{ text|linebreaksbr }} в шаблоне."""
+    return str(linebreaksbr(text, autoescape=True))
+
+
+def render_excerpt(html):
+    return Truncator(html).words(EXCERPT_WORDS, html=True)
+
+
+def render_stored_html(model, batch_size=1000):
+    """Перерисовывает сохранённый HTML всех записей model.
+
+    Подходит для Post и Comment (в том числе исторических моделей из
+    миграций); у изменённых постов увеличивается cache_version, чтобы
+    сбросить карточки. Возвращает число изменённых записей.
+    """
+    has_excerpt = any(field.name == "excerpt_html"
+                      for field in model._meta.get_fields())
+    html_fields = ["text_html", "excerpt_html"] if has_excerpt else [
+        "text_html"]
+    changed = 0
+    last_id = 0
+    while True:
+        batch = list(model.objects.filter(id__gt=last_id).order_by("id")
+                     .only("id", "text", *html_fields)[:batch_size])
+        if not batch:
+            return changed
+        last_id = batch[-1].id
+        stale = []
+        for record in batch:
+            text_html = render_text(record.text)
+            values = {"text_html": text_html}
+            if has_excerpt:
+                values["excerpt_html"] = render_excerpt(text_html)
+            if all(getattr(record, name) == value
+                   for name, value in values.items()):
+                continue
+            for name, value in values.items():
+                setattr(record, name, value)
+            stale.append(record)
+        update_fields = html_fields
+        if has_excerpt:
+            update_fields = html_fields + ["cache_version"]
+            for record in stale:
+                record.cache_version = F("cache_version") + 1
+        model.objects.bulk_update(stale, update_fields)
+        changed += len(stale)
@@ -0,0 +1,150 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+
+FTS_TABLE = "posts_post_fts"
+
+# внешняя таблица FTS5: хранит только индекс, текст читается из posts_post
+CREATE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "text, content='posts_post', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+CREATE_TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+        AFTER INSERT ON posts_post BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+        AFTER DELETE ON posts_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+            VALUES ('delete', old.id, old.text);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+        AFTER UPDATE OF text ON posts_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+            VALUES ('delete', old.id, old.text);
+            INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+        END""",
+)
+
+
+TRIGGER_NAMES = [f"{FTS_TABLE}_{suffix}"
+                 for suffix in ("insert", "delete", "update")]
+
+# есть ли FTS5 в сборке SQLite, по алиасу подключения
+fts5_support = {}
+
+
+def has_fts5(using=connection):
+    if using.alias not in fts5_support:
+        with using.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            fts5_support[using.alias] = bool(cursor.fetchone()[0])
+    return fts5_support[using.alias]
+
+
+def is_available(using=connection):
+    """Полнотекстовый индекс есть только в SQLite, собранном с FTS5;
+    иначе поиск идёт через icontains."""
+    return using.vendor == "sqlite" and has_fts5(using)
+
+
+def drop_triggers(using=connection):
+    with using.cursor() as cursor:
+        for name in TRIGGER_NAMES:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def install(using=connection):
+    """Создаёт индекс и триггеры, которые синхронизируют его с постами.
+
+    SQLite пересоздаёт posts_post при изменении схемы и теряет триггеры,
+    поэтому функция вызывается и после каждой миграции (post_migrate).
+    """
+    if using.vendor != "sqlite":
+        return
+    if not has_fts5(using):
+        # триггеры от сборки с FTS5 ломали бы каждое сохранение поста
+        drop_triggers(using)
+        return
+    with using.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",
+                       [FTS_TABLE])
+        created = cursor.fetchone() is None
+        cursor.execute(CREATE_TABLE)
+        for sql in CREATE_TRIGGERS:
+            cursor.execute(sql)
+        if created:
+            rebuild(using)
+
+
+def rebuild(using=connection):
+    with using.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    # запрос пользователя не должен попадать в синтаксис FTS5 как есть:
+    # каждое слово берём в кавычки и ищем по префиксу
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", query))
+
+
+class SearchResults:
+    """Найденные посты по убыванию релевантности (bm25).
+
+    Поддерживает count() и срезы, поэтому подходит для Paginator.
+    """
+
+    def __init__(self, query):
+        self.match = match_expression(query)
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s", [self.match])
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("SearchResults поддерживает только срезы")
+        if not self.match:
+            return []
+        start = index.start or 0
+        limit = -1 if index.stop is None else max(index.stop - start, 0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY rank LIMIT %s OFFSET %s",
+                [self.match, limit, start])
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = Post.objects.feed().in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def search_posts(query):
+    if is_available():
+        return SearchResults(query)
+    return Post.objects.feed().filter(text__icontains=query).order_by(
+        "-pub_date", "-id")
+
+
+def filter_matching(queryset, query):
+    """Оставляет в queryset посты, найденные по индексу."""
+    match = match_expression(query)
+    if not match:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+        [match]))
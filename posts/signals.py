@@ -0,0 +1,183 @@
+from django.contrib.auth import get_user_model
+from django.contrib.flatpages.models import FlatPage
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete,
+                                      post_migrate, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import search, stats, timeline
+from .cache import (author_generation_name, bump_generation,
+                    group_generation_name, group_id_key)
+from .models import Comment, Follow, Group, Post, UserStats
+
+
+User = get_user_model()
+
+
+def bump_card_version(posts):
+    posts.update(cache_version=F("cache_version") + 1)
+
+
+def feeds_changed(*group_ids):
+    bump_generation("posts", *[group_generation_name(group_id)
+                               for group_id in set(group_ids) if group_id])
+
+
+def authors_changed(*user_ids):
+    # профиль и боковая панель автора: число постов и подписок
+    bump_generation(*[author_generation_name(user_id)
+                      for user_id in set(user_ids)])
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_group(sender, instance, **kwargs):
+    instance.previous_group_id = None
+    if instance.pk is not None:
+        instance.previous_group_id = Post.objects.filter(
+            pk=instance.pk).values_list("group_id", flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        stats.increment_stats(instance.author_id, "posts_count")
+        timeline.fan_out(instance)
+        authors_changed(instance.author_id)
+    else:
+        bump_card_version(Post.objects.filter(pk=instance.pk))
+    feeds_changed(instance.group_id,
+                  getattr(instance, "previous_group_id", None))
+
+
+@receiver(post_delete, sender=Post)
+def drop_post_from_feeds(sender, instance, **kwargs):
+    stats.decrement_stats(instance.author_id, "posts_count")
+    feeds_changed(instance.group_id)
+    authors_changed(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        with transaction.atomic():
+            stats.increment_stats(instance.user_id, "following_count")
+            stats.increment_stats(instance.author_id, "followers_count")
+        timeline.mark_celebrities(instance.author_id)
+        timeline.backfill(instance)
+        authors_changed(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clear_timeline(sender, instance, **kwargs):
+    with transaction.atomic():
+        stats.decrement_stats(instance.user_id, "following_count")
+        stats.decrement_stats(instance.author_id, "followers_count")
+    # автор, у которого подписчиков стало меньше лимита, остаётся на
+    # чтении при запросе до backfill_timelines: раскладка его постов по
+    # всем лентам слишком тяжела для одного запроса
+    timeline.remove(instance)
+    authors_changed(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def refresh_author_pages(sender, instance, created, **kwargs):
+    # имя и фамилия показываются в профиле и на странице поста
+    if not created:
+        authors_changed(instance.pk)
+
+
+def comment_group_id(comment):
+    return Post.objects.filter(pk=comment.post_id).values_list(
+        "group_id", flat=True).first()
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F("comment_count") + 1,
+            cache_version=F("cache_version") + 1)
+        feeds_changed(comment_group_id(instance))
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(
+        comment_count=F("comment_count") - 1,
+        cache_version=F("cache_version") + 1)
+    feeds_changed(comment_group_id(instance))
+
+
+@receiver(pre_save, sender=Group)
+def remember_previous_slug(sender, instance, **kwargs):
+    instance.previous_slug = None
+    if instance.pk is not None:
+        instance.previous_slug = Group.objects.filter(
+            pk=instance.pk).values_list("slug", flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+def refresh_group_cards(sender, instance, created, **kwargs):
+    if not created:
+        bump_card_version(Post.objects.filter(group=instance))
+    previous_slug = getattr(instance, "previous_slug", None)
+    if previous_slug:
+        cache.delete(group_id_key(previous_slug))
+    cache.set(group_id_key(instance.slug), instance.pk, None)
+    feeds_changed(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def refresh_ungrouped_cards(sender, instance, **kwargs):
+    # SET_NULL обновляет посты одним UPDATE, без сигналов
+    bump_card_version(Post.objects.filter(group=instance))
+
+
+@receiver(post_delete, sender=Group)
+def forget_group(sender, instance, **kwargs):
+    cache.delete(group_id_key(instance.slug))
+    feeds_changed(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def refresh_renamed_author_cards(sender, instance, update_fields=None,
+                                 **kwargs):
+    if instance.pk is None:
+        return
+    if update_fields is not None and "username" not in update_fields:
+        return
+    renamed = User.objects.filter(pk=instance.pk).exclude(
+        username=instance.username).exists()
+    if renamed:
+        posts = Post.objects.filter(author_id=instance.pk)
+        bump_card_version(posts)
+        # имя показывается и под комментариями к чужим постам
+        bump_card_version(Post.objects.filter(
+            comments__author_id=instance.pk))
+        feeds_changed(*posts.values_list("group_id", flat=True).distinct())
+        authors_changed(instance.pk)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name != "posts":
+        return
+    connection = connections[using]
+    if Post._meta.db_table in connection.introspection.table_names():
+        search.install(connection)
+
+
+@receiver(post_save, sender=FlatPage)
+@receiver(post_delete, sender=FlatPage)
+@receiver(m2m_changed, sender=FlatPage.sites.through)
+def forget_flatpages(sender, **kwargs):
+    bump_generation("flatpages")
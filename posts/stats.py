@@ -0,0 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Post, UserStats
+
+
+User = get_user_model()
+
+
+def counted(queryset, field):
+    # подзапрос COUNT по OuterRef("pk"), чтобы пересчитать счётчики
+    # одним UPDATE, а не запросом на каждую строку
+    counts = queryset.filter(**{field: OuterRef("pk")}).order_by().values(
+        field).annotate(total=Count("pk")).values("total")
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def actual_comment_count():
+    """Выражение для Post.comment_count: число комментариев поста."""
+    return counted(Comment.objects.all(), "post")
+
+
+def actual_counts():
+    return {
+        "posts_count": counted(Post.objects.all(), "author"),
+        "followers_count": counted(Follow.objects.all(), "author"),
+        "following_count": counted(Follow.objects.all(), "user"),
+    }
+
+
+def rebuild_stats(user_ids):
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    counts = actual_counts()
+    users = User.objects.filter(pk__in=user_ids).annotate(
+        **counts).values("pk", *counts)
+    for row in users:
+        UserStats.objects.filter(user_id=row.pop("pk")).update(**row)
+
+
+def increment_stats(user_id, field):
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + 1})
+    if not updated:
+        rebuild_stats([user_id])
+
+
+def decrement_stats(user_id, field):
+    # при каскадном удалении пользователя строки статистики может уже
+    # не быть, поэтому здесь её не пересоздаём
+    UserStats.objects.filter(user_id=user_id, **{f"{field}__gt": 0}).update(
+        **{field: F(field) - 1})
+
+
+def get_stats(user):
+    try:
+        # если stats загружен через select_related("author__stats"),
+        # отдельного запроса не будет
+        return user.stats
+    except UserStats.DoesNotExist:
+        rebuild_stats([user.pk])
+        return UserStats.objects.get(user_id=user.pk)
@@ -1,7 +1,30 @@
 from django import template
+from django.utils.html import format_html
+
+from posts.paginators import elided_page_range as get_elided_page_range
+from posts.thumbnails import THUMBNAIL_SIZE, thumbnail_size
+
 register = template.Library()
 
 
 @register.filter 
 def addclass(field, css):
     return field.as_widget(attrs={"class": css})
+
+
+@register.simple_tag
+def elided_page_range(paginator, number):
+    # у CursorPaginator нет номеров страниц
+    if not hasattr(paginator, "num_pages"):
+        return []
+    return get_elided_page_range(paginator, number)
+
+
+@register.simple_tag
+def image_dimensions(post):
+    """Атрибуты width и height миниатюры без чтения файла."""
+    if post.image_width and post.image_height:
+        width, height = thumbnail_size(post.image_width, post.image_height)
+    else:
+        width, height = THUMBNAIL_SIZE
+    return format_html('width="{}" height="{}"', width, height)
@@ -1,16 +1,68 @@
+import base64
+import os
 import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from multiprocessing import Pool
+from unittest import mock
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client, override_settings
-from django.urls import reverse
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import (SimpleTestCase, TestCase, Client, RequestFactory,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 from django.utils.crypto import get_random_string
+from PIL import Image, ImageOps
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
 
-from .models import Post, Group, Follow, Comment
+from . import search, timeline
+from .cache import get_or_compute, group_id_for_slug, group_id_key
+from .middleware import AnonymousPageCacheMiddleware
+from .benchmark import (benchmark_views, captured_selects, explain,
+                        explain_views, plan_problems, seed_dataset,
+                        view_urls)
+from .models import (Post, Group, Follow, Comment, TimelineEntry,
+                     UserStats)
+from .paginators import elided_page_range, encode_cursor
+from .rendering import EXCERPT_WORDS
+from .thumbnails import (PLACEHOLDER_SIZE, PREVIEW_SIZE, image_metadata,
+                         prefetch_thumbnails, thumbnail_file, thumbnail_size)
+from .views import POSTS_PER_PAGE
+from yatube.mmap_cache import MmapCache
 
 
 User = get_user_model()
 
 
+class QueryBudgetMixin:
+    """Проверяет число SQL-запросов страницы по settings.QUERY_BUDGETS."""
+
+    def assertWithinQueryBudget(self, response):
+        request = response.wsgi_request
+        url_name = request.resolver_match.url_name
+        budget = settings.QUERY_BUDGETS.get(url_name)
+        if budget is None:
+            self.fail(f"Для страницы {url_name} не задан QUERY_BUDGETS")
+        self.assertLessEqual(
+            request.timings.queries, budget,
+            f"{url_name}: {request.timings.queries} запросов "
+            f"при бюджете {budget}")
+
+
 @override_settings(CACHES={
     "default": {
         "BACKEND": "django.core.cache.backends.dummy.DummyCache",
@@ -248,3 +300,1295 @@ class Hw04Test(TestCase):
         self.assertEqual(Comment.objects.filter(
             text="второй комментарий").count(),
             0)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="cursor_author")
+        self.group = Group.objects.create(
+            title="Группа для курсоров",
+            slug="cursor-group",
+            description="Описание"
+        )
+        for number in range(25):
+            Post.objects.create(text=f"пост номер {number}",
+                                author=self.user,
+                                group=self.group)
+
+    def walk_feed(self, url):
+        seen = []
+        response = self.client.get(url)
+        while True:
+            page = response.context["page"]
+            seen.extend(post.id for post in page)
+            if not page.has_next():
+                break
+            response = self.client.get(url, {"cursor": page.next_cursor})
+        return seen, response
+
+    def test_cursor_walks_every_feed_without_gaps(self):
+        expected = list(Post.objects.order_by(
+            "-pub_date", "-id").values_list("id", flat=True))
+        for url in (reverse("index"),
+                    reverse("group", args=[self.group.slug]),
+                    reverse("profile", args=[self.user.username])):
+            seen, _ = self.walk_feed(url)
+            self.assertEqual(seen, expected)
+
+    def test_previous_cursor_returns_previous_page(self):
+        url = reverse("index")
+        first = self.client.get(url).context["page"]
+        second = self.client.get(
+            url, {"cursor": first.next_cursor}).context["page"]
+        back = self.client.get(
+            url, {"cursor": second.previous_cursor}).context["page"]
+        self.assertEqual([post.id for post in back],
+                         [post.id for post in first])
+        self.assertFalse(back.has_previous())
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse("index"), {"cursor": "мусор"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["page"]), 10)
+
+    def test_cursor_with_bad_values_falls_back_to_first_page(self):
+        self.client.force_login(self.user)
+        Follow.objects.create(user=User.objects.create_user(username="fan"),
+                              author=self.user)
+        post = Post.objects.latest("id")
+        urls = (reverse("index"),
+                reverse("group", args=[self.group.slug]),
+                reverse("profile", args=[self.user.username]),
+                reverse("follow_index"),
+                reverse("post_comments", args=[self.user.username, post.id]))
+        for values in ([None, None], [1, 2], [[], {}]):
+            cursor = encode_cursor("n", values)
+            for url in urls:
+                with self.subTest(url=url, values=values):
+                    response = self.client.get(url, {"cursor": cursor})
+                    self.assertEqual(response.status_code, 200)
+                    # post_comments отдаёт порцию комментариев в items
+                    page = response.context.get("page",
+                                                response.context.get("items"))
+                    self.assertFalse(page.has_previous())
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.reader = User.objects.create_user(username="reader")
+        self.author = User.objects.create_user(username="writer")
+        self.client.force_login(self.reader)
+
+    def feed_texts(self):
+        response = self.client.get(reverse("follow_index"))
+        return [post.text for post in response.context["page"]]
+
+    def test_follow_fills_and_unfollow_clears_timeline(self):
+        Post.objects.create(text="старый пост", author=self.author)
+        self.client.get(reverse("profile_follow",
+                                args=[self.author.username]))
+        Post.objects.create(text="новый пост", author=self.author)
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 2)
+        self.assertEqual(self.feed_texts(), ["новый пост", "старый пост"])
+
+        self.client.get(reverse("profile_unfollow",
+                                args=[self.author.username]))
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader).exists())
+        self.assertEqual(self.feed_texts(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_posts_are_pulled_at_read(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text="пост знаменитости", author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed_texts(), ["пост знаменитости"])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2, TIMELINE_FANOUT_RESUME=1)
+    def test_posts_stay_in_feed_after_author_stops_being_celebrity(self):
+        others = [User.objects.create_user(username=f"other_{number}")
+                  for number in range(2)]
+        Follow.objects.create(user=self.reader, author=self.author)
+        for other in others:
+            Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(text="пост знаменитости", author=self.author)
+        self.assertEqual(self.feed_texts(), ["пост знаменитости"])
+        # отписка ничего не раскладывает, автор остаётся на чтении
+        with CaptureQueriesContext(connection) as queries:
+            Follow.objects.filter(user=others[0]).delete()
+        self.assertFalse(any("INSERT" in query["sql"]
+                             for query in queries.captured_queries))
+        self.assertEqual(self.feed_texts(), ["пост знаменитости"])
+        # ниже лимита, но выше TIMELINE_FANOUT_RESUME — без раскладки
+        call_command("backfill_timelines", stdout=StringIO())
+        self.assertFalse(TimelineEntry.objects.exists())
+        Follow.objects.filter(user=others[1]).delete()
+        call_command("backfill_timelines", stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 1)
+        self.assertFalse(timeline.is_celebrity(self.author.pk))
+        self.assertEqual(self.feed_texts(), ["пост знаменитости"])
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class CommentCountTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="commentator")
+        self.post = Post.objects.create(text="пост", author=self.user)
+        self.client.force_login(self.user)
+
+    def test_counter_follows_comments(self):
+        for text in ("первый", "второй"):
+            self.client.post(reverse("add_comment",
+                                     args=[self.user.username,
+                                           self.post.id]),
+                             {"text": text})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        Comment.objects.filter(text="первый").delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "1 комментариев")
+
+    def test_reconcile_command_fixes_drift(self):
+        Comment.objects.create(post=self.post, author=self.user, text="к")
+        Post.objects.filter(pk=self.post.pk).update(comment_count=42)
+        call_command("reconcile_comment_counts", stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class FeedQueryCountTest(TestCase):
+    # сколько запросов делает страница ленты независимо от числа постов
+    # (сессия и пользователь входят в это число, как и запросы для ETag:
+    # без кэша группа и автор ищутся по slug и имени ещё раз)
+    FEED_QUERIES = {
+        "index": 4,
+        "group": 6,
+        "profile": 7,
+        "follow_index": 5,
+    }
+
+    def setUp(self):
+        self.client = Client()
+        self.reader = User.objects.create_user(username="feed_reader")
+        self.group = Group.objects.create(
+            title="Лента",
+            slug="feed",
+            description="Описание"
+        )
+        self.author = self.create_author(0)
+        self.client.force_login(self.reader)
+
+    def create_author(self, number):
+        author = User.objects.create_user(username=f"feed_author_{number}")
+        Follow.objects.create(user=self.reader, author=author)
+        return author
+
+    def create_posts(self, count):
+        for number in range(count):
+            author = self.create_author(Post.objects.count())
+            post = Post.objects.create(text=f"пост {number}",
+                                       author=author,
+                                       group=self.group)
+            Comment.objects.create(post=post, author=author, text="к")
+
+    def urls(self):
+        return {
+            "index": reverse("index"),
+            "group": reverse("group", args=[self.group.slug]),
+            "profile": reverse("profile", args=[self.author.username]),
+            "follow_index": reverse("follow_index"),
+        }
+
+    def test_feed_query_count_does_not_depend_on_posts(self):
+        Post.objects.create(text="пост автора", author=self.author,
+                            group=self.group)
+        for posts in (1, 9):
+            self.create_posts(posts)
+            for name, url in self.urls().items():
+                with self.subTest(feed=name, posts=posts):
+                    with self.assertNumQueries(self.FEED_QUERIES[name]):
+                        self.client.get(url)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class QueryPlanTest(TestCase):
+    def test_feed_queries_use_indexes(self):
+        seed_dataset(users=20, groups=3, posts=300, comments=600,
+                     follows=60)
+        plans = explain_views()
+        self.assertIn("post_comments", plans)
+        for name, queries in plans.items():
+            for sql, plan in queries:
+                with self.subTest(view=name, sql=sql):
+                    self.assertEqual(plan_problems(plan), [])
+
+    def test_cursor_queries_are_bounded_by_feed_index(self):
+        seed_dataset(users=20, groups=3, posts=300, comments=600,
+                     follows=60)
+        user, urls = view_urls()
+        self.client.force_login(user)
+        for name in ("index", "group", "profile", "follow_index"):
+            first = self.client.get(urls[name]).context["page"]
+            second = self.client.get(
+                urls[name], {"cursor": first.next_cursor}).context["page"]
+            for cursor, bound in ((first.next_cursor, "pub_date<?"),
+                                  (second.previous_cursor, "pub_date>?")):
+                with captured_selects() as queries:
+                    self.client.get(urls[name], {"cursor": cursor})
+                plans = [explain(sql, params) for sql, params in queries]
+                with self.subTest(view=name, bound=bound):
+                    for plan in plans:
+                        self.assertEqual(plan_problems(plan), [])
+                    # страница выбирается поиском по pub_date в индексе,
+                    # а не перебором всей ленты автора или группы
+                    self.assertIn(bound, " ".join(sum(plans, [])))
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class BenchmarkTest(TestCase):
+    def test_benchmark_reports_every_view(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            with override_settings(MEDIA_ROOT=temp_directory):
+                seed_dataset(users=10, groups=2, posts=50, comments=100,
+                             follows=20, images=3)
+                self.assertEqual(Post.objects.exclude(image="").count(), 3)
+                results = benchmark_views(repeat=3, warmup=1)
+        self.assertEqual(set(results), {"index", "group", "profile", "post",
+                                        "follow_index", "new_post",
+                                        "add_comment"})
+        for name, metrics in results.items():
+            with self.subTest(view=name):
+                self.assertLessEqual(metrics["p50_ms"], metrics["p99_ms"])
+                self.assertGreater(metrics["queries"], 0)
+
+    def test_seed_data_runs_again_with_flush(self):
+        arguments = ["seed_data", "--users", "5", "--groups", "2",
+                     "--posts", "20", "--comments", "30", "--follows", "5",
+                     "--images", "0"]
+        call_command(*arguments, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command(*arguments, stdout=StringIO())
+        call_command(*arguments, "--flush", stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 20)
+        self.assertEqual(Comment.objects.count(), 30)
+        for post in Post.objects.all():
+            self.assertEqual(post.comment_count, post.comments.count())
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "post-cards",
+    }
+})
+class PostCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="card_author")
+        self.group = Group.objects.create(title="Старая группа",
+                                          slug="cards",
+                                          description="Описание")
+        self.post = Post.objects.create(text="исходный текст",
+                                        author=self.user,
+                                        group=self.group)
+        self.client.force_login(self.user)
+
+    def index(self):
+        return self.client.get(reverse("index"))
+
+    def test_card_is_served_from_cache(self):
+        self.index()
+        Post.objects.filter(pk=self.post.pk).update(text="тихая правка")
+        self.assertContains(self.index(), "исходный текст")
+
+    def test_card_version_bumps(self):
+        self.index()
+        self.client.post(reverse("post_edit",
+                                 args=[self.user.username, self.post.id]),
+                         {"text": "новый текст", "group": self.group.id})
+        self.assertContains(self.index(), "новый текст")
+
+        self.client.post(reverse("add_comment",
+                                 args=[self.user.username, self.post.id]),
+                         {"text": "комментарий"})
+        self.assertContains(self.index(), "1 комментариев")
+
+        self.group.title = "Новая группа"
+        self.group.save()
+        self.assertContains(self.index(), "#Новая группа")
+
+        self.user.username = "renamed_author"
+        self.user.save()
+        self.assertContains(self.index(), "@renamed_author")
+
+    def test_edit_link_is_not_cached_for_other_users(self):
+        self.assertContains(self.index(), "Редактировать")
+        self.client.force_login(User.objects.create_user(username="other"))
+        self.assertNotContains(self.index(), "Редактировать")
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "anonymous-pages",
+    }
+})
+class AnonymousPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author_client = Client()
+        self.author = User.objects.create_user(username="page_author")
+        self.author_client.force_login(self.author)
+        self.group = Group.objects.create(title="Кэш", slug="cached",
+                                          description="Описание")
+        self.other_group = Group.objects.create(title="Другая",
+                                                slug="other",
+                                                description="Описание")
+        self.post = Post.objects.create(text="первый пост",
+                                        author=self.author,
+                                        group=self.group)
+
+    def test_cached_page_skips_view_and_database(self):
+        url = reverse("group", args=[self.group.slug])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, "первый пост")
+
+    def test_new_post_bumps_generation(self):
+        self.client.get(reverse("index"))
+        self.author_client.post(reverse("new_post"), {"text": "свежий пост"})
+        self.assertContains(self.client.get(reverse("index")), "свежий пост")
+
+    def test_group_generation_is_per_group(self):
+        url = reverse("group", args=[self.group.slug])
+        self.client.get(url)
+        Post.objects.create(text="в другой группе", author=self.author,
+                            group=self.other_group)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        self.author_client.post(reverse("add_comment",
+                                        args=[self.author.username,
+                                              self.post.id]),
+                                {"text": "комментарий"})
+        self.assertContains(self.client.get(url), "1 комментариев")
+
+    def test_only_page_and_cursor_params_are_cached(self):
+        url = reverse("group", args=[self.group.slug])
+        self.client.get(url, {"page": 1})
+        with self.assertNumQueries(0):
+            self.client.get(url, {"page": 1})
+        for params in ({"x": "случайное"}, {"page": "abc"},
+                       {"cursor": "мусор"}):
+            with self.subTest(params=params):
+                self.client.get(url, params)
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(url, params)
+                self.assertTrue(queries.captured_queries)
+        # в кэше только ?page=1
+        self.assertEqual(len([key for key in cache._cache
+                              if ":page:group:" in key]), 1)
+
+    def test_stale_page_is_served_while_another_worker_renders(self):
+        self.client.get(reverse("index"))
+        Post.objects.create(text="свежий пост", author=self.author)
+        # новую версию главной уже рендерит другой процесс
+        with mock.patch("posts.cache.acquire_lock", return_value=None):
+            self.assertNotContains(self.client.get(reverse("index")),
+                                   "свежий пост")
+        self.assertContains(self.client.get(reverse("index")), "свежий пост")
+
+    def test_profile_is_cached_until_author_changes(self):
+        url = reverse("profile", args=[self.author.username])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), "первый пост")
+        follower = User.objects.create_user(username="page_follower")
+        Follow.objects.create(user=follower, author=self.author)
+        self.assertEqual(self.client.get(url).context["num_of_followers"], 1)
+
+    def test_expired_page_is_rendered_once(self):
+        renders = []
+
+        def view(request):
+            renders.append(request)
+            time.sleep(0.2)
+            return HttpResponse(f"версия {len(renders)}")
+
+        middleware = AnonymousPageCacheMiddleware(lambda request: None)
+
+        def get_index():
+            request = RequestFactory().get(reverse("index"))
+            request.user = AnonymousUser()
+            request.resolver_match = resolve(reverse("index"))
+            return middleware.process_view(request, view, (), {}).content
+
+        get_index()
+        Post.objects.create(text="свежий пост", author=self.author)
+        barrier = threading.Barrier(8)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(get_index())
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(renders), 2)
+        self.assertEqual(sorted(results), sorted(
+            ["версия 2".encode()] + ["версия 1".encode()] * 7))
+
+    def test_authenticated_users_are_not_cached(self):
+        self.author_client.get(reverse("index"))
+        Post.objects.filter(pk=self.post.pk).update(
+            text="тихая правка", excerpt_html="тихая правка",
+            cache_version=100)
+        self.assertContains(self.author_client.get(reverse("index")),
+                            "тихая правка")
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class UserStatsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username="stats_author")
+        self.reader = User.objects.create_user(username="stats_reader")
+        self.client.force_login(self.reader)
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_posts_and_follows(self):
+        post = Post.objects.create(text="пост", author=self.author)
+        Post.objects.create(text="ещё пост", author=self.author)
+        self.client.get(reverse("profile_follow",
+                                args=[self.author.username]))
+        self.assertEqual(self.stats(self.author).posts_count, 2)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+
+        post.delete()
+        self.client.get(reverse("profile_unfollow",
+                                args=[self.author.username]))
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+
+    def test_profile_sidebar_reads_stats(self):
+        Post.objects.create(text="пост", author=self.author)
+        response = self.client.get(reverse("profile",
+                                           args=[self.author.username]))
+        self.assertEqual(response.context["posts_count"], 1)
+
+    def test_rebuild_command_restores_drifted_stats(self):
+        Post.objects.create(text="пост", author=self.author)
+        UserStats.objects.all().delete()
+        call_command("rebuild_user_stats", stdout=StringIO())
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.reader).posts_count, 0)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class ThumbnailWorkerTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="photographer")
+        self.client.force_login(self.user)
+
+    def test_placeholder_until_worker_renders_thumbnail(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            with override_settings(MEDIA_ROOT=temp_directory):
+                with open("posts/tests/testImg.jpg", "rb") as img:
+                    self.client.post(reverse("new_post"),
+                                     {"text": "пост с картинкой",
+                                      "image": img})
+                post = Post.objects.get(text="пост с картинкой")
+                self.assertFalse(post.thumbnail_ready)
+                response = self.client.get(reverse("index"))
+                self.assertContains(response, f"image_{post.id}")
+                self.assertContains(response, post.image_placeholder)
+                self.assertEqual(post.image_format, "JPEG")
+                self.assertEqual(post.image_size, post.image.size)
+                with post.image.open() as image_file:
+                    self.assertEqual(
+                        (post.image_width, post.image_height),
+                        Image.open(image_file).size)
+
+                call_command("thumbnail_worker", "--once",
+                             "--processes", "1", stdout=StringIO())
+                post.refresh_from_db()
+                self.assertTrue(post.thumbnail_ready)
+                response = self.client.get(reverse("index"))
+                self.assertNotContains(response, "data:image/")
+                self.assertContains(response, "/media/cache/")
+
+                with open("posts/tests/testImg.jpg", "rb") as img:
+                    self.client.post(reverse("post_edit",
+                                             args=[self.user.username,
+                                                   post.id]),
+                                     {"text": "новая картинка",
+                                      "image": img})
+                post.refresh_from_db()
+                self.assertFalse(post.thumbnail_ready)
+                self.assertTrue(post.image_placeholder)
+
+                self.client.post(reverse("post_edit",
+                                         args=[self.user.username, post.id]),
+                                 {"text": "без картинки",
+                                  "image-clear": "on"})
+                post.refresh_from_db()
+                self.assertIsNone(post.image_width)
+                self.assertEqual(post.image_placeholder, "")
+
+    def test_metadata_decodes_only_a_small_preview(self):
+        image = Image.new("RGB", (4000, 2000), (200, 10, 10))
+        exif = image.getexif()
+        exif[0x0112] = 6  # повёрнута на 90°
+        content = BytesIO()
+        image.save(content, "JPEG", exif=exif.tobytes())
+        upload = SimpleUploadedFile("big.jpg", content.getvalue())
+        with mock.patch("posts.thumbnails.ImageOps.exif_transpose",
+                        wraps=ImageOps.exif_transpose) as transpose:
+            metadata = image_metadata(upload)
+        self.assertLessEqual(max(transpose.call_args[0][0].size),
+                             max(PREVIEW_SIZE))
+        self.assertEqual((metadata["image_width"], metadata["image_height"]),
+                         (4000, 2000))
+        placeholder = base64.b64decode(
+            metadata["image_placeholder"].split(",", 1)[1])
+        self.assertEqual(Image.open(BytesIO(placeholder)).size,
+                         PLACEHOLDER_SIZE)
+
+    def test_worker_describes_images_uploaded_elsewhere(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            with override_settings(MEDIA_ROOT=temp_directory):
+                with open("posts/tests/testImg.jpg", "rb") as img:
+                    post = Post.objects.create(
+                        text="из скрипта", author=self.user,
+                        image=SimpleUploadedFile("img.jpg", img.read()))
+                call_command("thumbnail_worker", "--once",
+                             "--processes", "1", stdout=StringIO())
+                post.refresh_from_db()
+                self.assertTrue(post.thumbnail_ready)
+                self.assertEqual(post.image_format, "JPEG")
+                self.assertTrue(post.image_placeholder.startswith(
+                    "data:image/jpeg;base64,"))
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class ThumbnailPrefetchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="gallery")
+        self.client.force_login(self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        with open("posts/tests/testImg.jpg", "rb") as img:
+            content = img.read()
+        for number in range(POSTS_PER_PAGE):
+            Post.objects.create(
+                text=f"картинка {number}", author=self.user,
+                image=SimpleUploadedFile(f"img_{number}.jpg", content))
+        call_command("thumbnail_worker", "--once",
+                     "--processes", "1", stdout=StringIO())
+
+    def kvstore_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query for query in queries.captured_queries
+                          if "thumbnail_kvstore" in query["sql"]]
+
+    def test_feed_page_takes_one_thumbnail_query(self):
+        response, queries = self.kvstore_queries(reverse("index"))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.content.decode().count("/media/cache/"),
+                         POSTS_PER_PAGE)
+
+    def test_image_size_comes_from_stored_metadata(self):
+        post = Post.objects.first()
+        width, height = thumbnail_size(post.image_width, post.image_height)
+        prefetch_thumbnails([post])
+        with post.thumbnail.storage.open(post.thumbnail.name) as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (width, height))
+        with self.assertNumQueries(0):
+            html = render_to_string("includes/post_image.html",
+                                    {"post": post})
+        self.assertIn(f'width="{width}" height="{height}"', html)
+
+    def test_missing_thumbnail_goes_back_to_worker(self):
+        KVStore.objects.all().delete()
+        response, queries = self.kvstore_queries(reverse("index"))
+        self.assertEqual(len(queries), 1)
+        self.assertNotContains(response, "/media/cache/")
+        self.assertEqual(Post.objects.filter(thumbnail_ready=False).count(),
+                         POSTS_PER_PAGE)
+
+    @override_settings(CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "lost-thumbnails",
+        }
+    })
+    def test_missing_thumbnail_invalidates_cached_card(self):
+        cache.clear()
+        self.assertContains(self.client.get(reverse("index")),
+                            "/media/cache/")
+        versions = dict(Post.objects.values_list("id", "cache_version"))
+        KVStore.objects.all().delete()
+        cache.delete_many([add_prefix(thumbnail_file(post.image).key)
+                           for post in Post.objects.all()])
+        self.assertNotContains(self.client.get(reverse("index")),
+                               "/media/cache/")
+        for post_id, version in Post.objects.values_list("id",
+                                                         "cache_version"):
+            self.assertEqual(version, versions[post_id] + 1)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "view-stats",
+    }
+})
+class RequestTimingTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="budget_reader")
+        self.author = User.objects.create_user(username="budget_author")
+        self.group = Group.objects.create(title="Группа", slug="budget",
+                                          description="Описание")
+        for number in range(15):
+            post = Post.objects.create(text=f"пост {number}",
+                                       author=self.author, group=self.group)
+        for number in range(5):
+            Comment.objects.create(post=post, author=self.user,
+                                   text=f"комментарий {number}")
+        self.post = post
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.force_login(self.user)
+
+    def test_views_stay_within_query_budget(self):
+        author = self.author.username
+        responses = [
+            self.client.get(reverse("index")),
+            self.client.get(reverse("group", args=[self.group.slug])),
+            self.client.get(reverse("profile", args=[author])),
+            self.client.get(reverse("post", args=[author, self.post.id])),
+            self.client.get(reverse("follow_index")),
+            self.client.post(reverse("new_post"), {"text": "новый пост"}),
+            self.client.post(reverse("add_comment",
+                                     args=[author, self.post.id]),
+                             {"text": "ещё комментарий"}),
+        ]
+        for response in responses:
+            with self.subTest(url=response.wsgi_request.path):
+                self.assertWithinQueryBudget(response)
+
+    def test_server_timing_header_and_stats(self):
+        response = self.client.get(reverse("index"))
+        self.assertIn("db;dur=", response["Server-Timing"])
+        self.assertIn("tpl;dur=", response["Server-Timing"])
+
+        self.assertEqual(
+            self.client.get(reverse("view_stats")).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get(reverse("view_stats")).json()
+        self.assertEqual(stats["index"]["requests"], 1)
+        self.assertGreater(stats["index"]["queries"], 0)
+        self.assertGreater(stats["index"]["template_ms"], 0)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class SearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="searcher")
+        self.relevant = Post.objects.create(
+            text="Ёжики и ежевика: ежики любят ежевику", author=self.user)
+        self.other = Post.objects.create(
+            text="Про ежевику и много других слов о саде, огороде и даче",
+            author=self.user)
+        Post.objects.create(text="Совсем другой текст", author=self.user)
+
+    def search(self, query):
+        response = self.client.get(reverse("search"), {"q": query})
+        return list(response.context["page"])
+
+    def test_search_ranks_and_paginates(self):
+        self.assertEqual(self.search("ежевик"), [self.relevant, self.other])
+        self.assertEqual(self.search("ЕЖИКИ"), [self.relevant])
+        self.assertEqual(self.search('" OR *'), [])
+        for number in range(12):
+            Post.objects.create(text=f"ежевика {number}", author=self.user)
+        response = self.client.get(reverse("search"), {"q": "ежевика"})
+        self.assertEqual(response.context["paginator"].count, 13)
+        self.assertContains(response, "?q=%D0%B5%D0%B6%D0%B5%D0%B2%D0%B8"
+                                      "%D0%BA%D0%B0&amp;page=2")
+
+    def test_index_follows_edits_and_deletes(self):
+        self.other.text = "Про малину"
+        self.other.save()
+        self.assertEqual(self.search("малина"), [])
+        self.assertEqual(self.search("малину"), [self.other])
+        self.assertEqual(self.search("ежевику"), [self.relevant])
+        self.relevant.delete()
+        self.assertEqual(self.search("ежевику"), [])
+
+    def test_search_without_fts5_falls_back_to_icontains(self):
+        with mock.patch("posts.search.has_fts5", return_value=False):
+            search.install()
+            self.assertEqual(self.search("ежевик"),
+                             [self.other, self.relevant])
+            Post.objects.create(text="новая ежевика", author=self.user)
+            admin = User.objects.create_superuser("admin", "a@a.ru", "pass")
+            self.client.force_login(admin)
+            response = self.client.get("/admin/posts/post/",
+                                       {"q": "новая"})
+            self.assertEqual(len(response.context["cl"].result_list), 1)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master "
+                           "WHERE type = 'trigger' AND name LIKE %s",
+                           [f"{search.FTS_TABLE}%"])
+            self.assertEqual(cursor.fetchall(), [])
+        search.install()
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser("admin", "a@a.ru", "pass")
+        self.client.force_login(admin)
+        response = self.client.get("/admin/posts/post/", {"q": "ежики"})
+        self.assertEqual(list(response.context["cl"].result_list),
+                         [self.relevant])
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class CommentPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username="viral_author")
+        self.post = Post.objects.create(text="вирусный пост",
+                                        author=self.author)
+        for number in range(25):
+            commenter = User.objects.create_user(username=f"fan_{number}")
+            Comment.objects.create(post=self.post, author=commenter,
+                                   text=f"комментарий {number}")
+
+    def post_url(self):
+        return reverse("post", args=[self.author.username, self.post.id])
+
+    def test_post_page_shows_first_batch_with_authors(self):
+        # без кэша имя автора из адреса проверяется в ETag и во view
+        with self.assertNumQueries(5):
+            response = self.client.get(self.post_url())
+        self.assertContains(response, "@fan_24")
+        self.assertEqual(len(response.context["items"]), 20)
+        self.assertContains(response, "js-load-comments")
+
+    def test_load_more_returns_next_batch(self):
+        response = self.client.get(self.post_url())
+        response = self.client.get(
+            reverse("post_comments", args=[self.author.username,
+                                           self.post.id]),
+            {"cursor": response.context["next_cursor"]})
+        self.assertEqual(
+            [comment.text for comment in response.context["items"]],
+            [f"комментарий {number}" for number in range(4, -1, -1)])
+        self.assertNotContains(response, "js-load-comments")
+        self.assertNotContains(response, "<html")
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "conditional-get",
+    }
+})
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="etag_author")
+        self.reader = User.objects.create_user(username="etag_reader")
+        self.group = Group.objects.create(title="Группа", slug="etag",
+                                          description="Описание")
+        self.post = Post.objects.create(text="пост", author=self.author,
+                                        group=self.group)
+
+    def assertNotModified(self, url):
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.templates, [])
+        return etag
+
+    def test_unchanged_pages_return_304(self):
+        urls = [reverse("index"),
+                reverse("group", args=[self.group.slug]),
+                reverse("profile", args=[self.author.username]),
+                reverse("post", args=[self.author.username, self.post.id])]
+        for url in urls:
+            with self.subTest(url=url, user="anonymous"):
+                self.assertNotModified(url)
+        self.client.force_login(self.reader)
+        for url in urls + [reverse("follow_index")]:
+            with self.subTest(url=url, user="reader"):
+                self.assertNotModified(url)
+
+    def test_changes_invalidate_etag(self):
+        self.client.force_login(self.reader)
+        post_url = reverse("post", args=[self.author.username, self.post.id])
+        profile_url = reverse("profile", args=[self.author.username])
+        post_etag = self.assertNotModified(post_url)
+        profile_etag = self.assertNotModified(profile_url)
+
+        Comment.objects.create(post=self.post, author=self.reader, text="к")
+        response = self.client.get(post_url, HTTP_IF_NONE_MATCH=post_etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.client.get(reverse("profile_follow",
+                                args=[self.author.username]))
+        response = self.client.get(profile_url,
+                                   HTTP_IF_NONE_MATCH=profile_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_viewer(self):
+        url = reverse("post", args=[self.author.username, self.post.id])
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.reader)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_slug_is_not_cached_forever(self):
+        with mock.patch.object(cache, "set") as cache_set:
+            self.assertEqual(group_id_for_slug("later"), 0)
+        cache_set.assert_called_once_with(group_id_key("later"), 0,
+                                          settings.GROUP_MISSING_TIMEOUT)
+        cache.delete(group_id_key("etag"))
+        with mock.patch.object(cache, "set") as cache_set:
+            self.assertEqual(group_id_for_slug("etag"), self.group.pk)
+        cache_set.assert_called_once_with(group_id_key("etag"),
+                                          self.group.pk, None)
+
+    def test_group_created_without_save_is_found_after_miss_expires(self):
+        with override_settings(GROUP_MISSING_TIMEOUT=1):
+            self.assertEqual(group_id_for_slug("later"), 0)
+        Group.objects.bulk_create([Group(title="Позже", slug="later",
+                                         description="Описание")])
+        self.assertEqual(group_id_for_slug("later"), 0)
+        time.sleep(1.1)
+        group = Group.objects.get(slug="later")
+        self.assertEqual(group_id_for_slug("later"), group.pk)
+        response = self.client.get(reverse("group", args=["later"]))
+        self.assertIn("ETag", response)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "post-view",
+    }
+})
+class PostViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="detail_author")
+        self.other = User.objects.create_user(username="detail_other")
+        self.group = Group.objects.create(title="Группа", slug="detail",
+                                          description="Описание")
+        self.post = Post.objects.create(text="пост", author=self.author,
+                                        group=self.group)
+        Comment.objects.create(post=self.post, author=self.other, text="к")
+
+    def test_post_view_query_count(self):
+        url = reverse("post", args=[self.author.username, self.post.id])
+        self.client.get(url)
+        # ETag, пост с автором, группой и счётчиками, комментарии;
+        # имя автора уже в кэше
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.context["posts_count"], 1)
+        self.assertEqual(response.context["author"], self.author)
+
+    def test_post_of_another_author_is_404(self):
+        response = self.client.get(
+            reverse("post", args=[self.other.username, self.post.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_username_does_not_reach_db(self):
+        url = reverse("profile", args=["nobody_here"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        User.objects.create_user(username="nobody_here")
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_renamed_author_moves_to_new_url(self):
+        url = reverse("profile", args=[self.author.username])
+        self.client.get(url)
+        self.author.username = "renamed_detail_author"
+        self.author.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(
+            reverse("profile", args=["renamed_detail_author"])).status_code,
+            200)
+
+    def test_missing_stats_are_rebuilt(self):
+        UserStats.objects.filter(user=self.author).delete()
+        response = self.client.get(
+            reverse("post", args=[self.author.username, self.post.id]))
+        self.assertEqual(response.context["posts_count"], 1)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class ElidedPageRangeTest(TestCase):
+    def test_window_does_not_grow_with_page_count(self):
+        paginator = Paginator(range(500000), 10)
+        self.assertEqual(elided_page_range(paginator, 1),
+                         [1, 2, 3, None, 50000])
+        self.assertEqual(elided_page_range(paginator, 2500),
+                         [1, None, 2498, 2499, 2500, 2501, 2502, None,
+                          50000])
+        self.assertEqual(elided_page_range(paginator, 49999),
+                         [1, None, 49997, 49998, 49999, 50000])
+        self.assertEqual(elided_page_range(Paginator(range(30), 10), 2),
+                         [1, 2, 3])
+
+    def test_index_renders_elided_links(self):
+        user = User.objects.create_user(username="prolific")
+        Post.objects.bulk_create([Post(text=f"пост {number}", author=user)
+                                  for number in range(200)])
+        response = self.client.get(reverse("index"), {"page": 10})
+        self.assertContains(response, "&hellip;", count=2)
+        self.assertContains(response, 'href="?page=20"')
+        self.assertNotContains(response, 'href="?page=15"')
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "feed-counts",
+    }
+}, FEED_COUNT_EXACT_LIMIT=5)
+class FeedCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="counted_author")
+        self.posts = [Post.objects.create(text=f"пост {number}",
+                                          author=self.author)
+                      for number in range(8)]
+
+    def index_count(self):
+        # анонимная страница кэшируется целиком, поэтому заходим с логином
+        self.client.force_login(self.author)
+        return self.client.get(reverse("index")).context["paginator"].count
+
+    def test_small_feed_is_counted_exactly(self):
+        with self.settings(FEED_COUNT_EXACT_LIMIT=100):
+            self.assertEqual(self.index_count(), 8)
+            self.posts[0].delete()
+            self.assertEqual(self.index_count(), 7)
+
+    def test_large_feed_count_is_estimated_and_cached(self):
+        self.posts[3].delete()
+        # оценка по диапазону id не видит удалённый пост
+        self.assertEqual(self.index_count(), 8)
+        Post.objects.create(text="новый пост", author=self.author)
+        self.assertEqual(self.index_count(), 8)
+
+    def test_profile_count_comes_from_stats(self):
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        response = self.client.get(reverse("profile",
+                                           args=[self.author.username]))
+        self.assertEqual(response.context["paginator"].count, 42)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "flatpages",
+    }
+})
+class FlatPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.page = FlatPage.objects.create(url="/about-us/",
+                                            title="О нас",
+                                            content="старый текст")
+        self.page.sites.add(Site.objects.get_current())
+
+    def test_anonymous_page_is_served_without_queries(self):
+        self.assertContains(self.client.get(reverse("about")), "старый текст")
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("about"))
+        self.assertContains(response, "старый текст")
+
+    def test_edits_and_site_changes_invalidate_page(self):
+        self.client.get(reverse("about"))
+        self.page.content = "новый текст"
+        self.page.save()
+        self.assertContains(self.client.get(reverse("about")), "новый текст")
+        self.page.sites.clear()
+        self.assertEqual(self.client.get(reverse("about")).status_code, 404)
+
+    def test_logged_in_header_is_not_shared(self):
+        self.client.get(reverse("about"))
+        user = User.objects.create_user(username="flat_reader")
+        self.client.force_login(user)
+        self.assertContains(self.client.get(reverse("about")),
+                            "Пользователь: flat_reader")
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    }
+})
+class RenderedHtmlTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username="html_author")
+        self.client.force_login(self.author)
+        self.post = Post.objects.create(text="<b>жирный</b>\nвторая строка",
+                                        author=self.author)
+
+    def test_html_is_rendered_on_save(self):
+        self.assertEqual(self.post.text_html,
+                         "&lt;b&gt;жирный&lt;/b&gt;<br>вторая строка")
+        comment = Comment.objects.create(post=self.post, author=self.author,
+                                         text="a & b")
+        self.assertEqual(comment.text_html, "a &amp; b")
+
+    def test_feed_shows_excerpt_and_post_page_full_text(self):
+        words = [f"слово{number}" for number in range(EXCERPT_WORDS + 10)]
+        self.client.post(reverse("post_edit",
+                                 args=[self.author.username, self.post.id]),
+                         {"text": " ".join(words)})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.text_html, " ".join(words))
+        index = self.client.get(reverse("index"))
+        self.assertContains(index, words[EXCERPT_WORDS - 1])
+        self.assertNotContains(index, words[-1])
+        self.assertContains(
+            self.client.get(reverse("post", args=[self.author.username,
+                                                  self.post.id])),
+            words[-1])
+
+    def test_command_renders_stale_rows(self):
+        Post.objects.filter(pk=self.post.pk).update(text="обновлено",
+                                                    text_html="")
+        out = StringIO()
+        call_command("render_post_html", stdout=out)
+        self.assertIn("Обновлено постов: 1, комментариев: 0", out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.excerpt_html, "обновлено")
+        self.assertEqual(self.post.cache_version, 1)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "stampede",
+    }
+}, CACHE_STALE_TIMEOUT=60, CACHE_WAIT_INTERVAL=0.01)
+class GetOrComputeTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def compute(self, value="свежее"):
+        with self.calls_lock:
+            self.calls += 1
+        time.sleep(0.2)
+        return value
+
+    def run_concurrently(self, function, threads=8):
+        barrier = threading.Barrier(threads)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(function())
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def test_missing_key_is_computed_once(self):
+        results = self.run_concurrently(
+            lambda: get_or_compute("hot", self.compute, 60))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ["свежее"] * 8)
+
+    def test_expired_key_is_recomputed_once_and_stale_value_served(self):
+        get_or_compute("hot", lambda: "старое", 0.05)
+        time.sleep(0.1)
+        results = self.run_concurrently(
+            lambda: get_or_compute("hot", self.compute, 60))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(results), ["свежее"] + ["старое"] * 7)
+        self.assertEqual(get_or_compute("hot", self.compute, 60), "свежее")
+
+    def test_expensive_key_is_refreshed_early(self):
+        # пересчёт длиннее срока жизни: XFetch обновит ключ до срока
+        cache.set("hot", ("старое", 3600, time.time() + 60, None), 120)
+        self.assertEqual(get_or_compute("hot", lambda: "свежее", 60),
+                         "свежее")
+        cache.set("cold", ("старое", 0, time.time() + 60, None), 120)
+        self.assertEqual(get_or_compute("cold", lambda: "свежее", 60),
+                         "старое")
+
+
+def increment_shared_counter(path):
+    cache = MmapCache(path, {})
+    for _ in range(200):
+        cache.incr("counter")
+
+
+class MmapCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.mmap")
+        self.cache = self.open_cache()
+
+    def open_cache(self, size=256 * 1024, slots=256):
+        return MmapCache(self.path, {"OPTIONS": {"SIZE": size,
+                                                 "SLOTS": slots}})
+
+    def test_basic_operations(self):
+        self.cache.set("post", {"text": "пост"})
+        self.assertEqual(self.cache.get("post"), {"text": "пост"})
+        self.assertFalse(self.cache.add("post", "другой"))
+        self.assertTrue(self.cache.add("group", "группа"))
+        self.cache.delete("post")
+        self.assertIsNone(self.cache.get("post"))
+        self.cache.set("short", 1, timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get("short"))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("group"))
+
+    def test_entries_are_shared_between_instances(self):
+        other = self.open_cache()
+        self.cache.set("generation", 1)
+        other.incr("generation")
+        self.assertEqual(self.cache.get("generation"), 2)
+        with self.assertRaises(ValueError):
+            other.incr("missing")
+
+    def test_threads_share_one_open_file(self):
+        self.cache.set("key", "значение")
+        instances = []
+
+        def worker():
+            instance = self.open_cache()
+            instance.get("key")
+            instances.append(instance)
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({instance._fd for instance in instances},
+                         {self.cache._fd})
+
+    def test_refuses_links_and_foreign_files(self):
+        target = os.path.join(os.path.dirname(self.path), "target")
+        link = os.path.join(os.path.dirname(self.path), "link.mmap")
+        os.symlink(target, link)
+        with self.assertRaises(OSError):
+            MmapCache(link, {}).get("key")
+        self.assertFalse(os.path.exists(target))
+        with mock.patch("os.getuid", return_value=os.getuid() + 1):
+            with self.assertRaises(PermissionError):
+                MmapCache(target, {}).get("key")
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.set("hot", "x" * 1000)
+        for number in range(400):
+            self.cache.set(f"cold:{number}", "x" * 1000)
+            self.cache.get("hot")
+        self.assertEqual(self.cache.get("hot"), "x" * 1000)
+        self.assertIsNone(self.cache.get("cold:0"))
+        self.assertLessEqual(self.cache.stats()["bytes"], 256 * 1024)
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set("counter", 0)
+        with Pool(4) as pool:
+            pool.map(increment_shared_counter, [self.path] * 4)
+        self.assertEqual(self.cache.get("counter"), 800)
@@ -0,0 +1,200 @@
+import base64
+import logging
+from io import BytesIO
+from multiprocessing import Pool
+
+import django
+from django.db import connections
+from django.db.models import F
+from PIL import Image, ImageFilter, ImageOps
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from .models import Post
+from .signals import feeds_changed
+
+
+logger = logging.getLogger(__name__)
+
+# миниатюра обрезается по центру до 960x540; размеры <img> шаблоны
+# считают по сохранённым размерам картинки (thumbnail_size)
+THUMBNAIL_GEOMETRY = "960x540"
+THUMBNAIL_SIZE = (960, 540)
+THUMBNAIL_OPTIONS = {"crop": "center", "upscale": True}
+# размытая заглушка с теми же пропорциями, что и миниатюра
+PLACEHOLDER_SIZE = (16, 9)
+# до какого размера уменьшать картинку перед обрезкой заглушки
+PREVIEW_SIZE = (64, 64)
+IMAGE_METADATA_FIELDS = ("image_width", "image_height", "image_format",
+                         "image_size", "image_placeholder")
+
+
+def thumbnail_size(width, height):
+    """Размер миниатюры картинки width x height, как его считает sorl."""
+    box_width, box_height = THUMBNAIL_SIZE
+    factor = max(box_width / width, box_height / height)
+    if factor < 1 or THUMBNAIL_OPTIONS.get("upscale"):
+        width, height = round(width * factor), round(height * factor)
+    return min(width, box_width), min(height, box_height)
+
+
+def image_metadata(image_file):
+    """Размеры, формат, размер файла и размытая заглушка картинки.
+
+    Файл читается один раз при загрузке, чтобы шаблонам не нужно было
+    открывать его или обращаться к хранилищу миниатюр.
+    """
+    image_file.seek(0)
+    with Image.open(image_file) as image:
+        # размеры и формат берутся из заголовка, без декодирования
+        width, height = image.size
+        image_format = image.format or ""
+        # thumbnail через draft декодирует JPEG сразу в уменьшенном
+        # масштабе, поворот по EXIF (как в sorl) делается уже у превью
+        image.thumbnail(PREVIEW_SIZE)
+        preview = ImageOps.fit(
+            ImageOps.exif_transpose(image).convert("RGB"), PLACEHOLDER_SIZE,
+            Image.BILINEAR, centering=(0.5, 0.5))
+    image_file.seek(0)
+    preview = preview.filter(ImageFilter.GaussianBlur(1))
+    content = BytesIO()
+    preview.save(content, "JPEG", quality=40)
+    encoded = base64.b64encode(content.getvalue()).decode()
+    return {
+        "image_width": width,
+        "image_height": height,
+        "image_format": image_format,
+        "image_size": image_file.size,
+        "image_placeholder": f"data:image/jpeg;base64,{encoded}",
+    }
+
+
+def set_image_metadata(post, image_file=None):
+    """Заполняет поля картинки поста; без картинки — очищает их."""
+    if image_file:
+        values = image_metadata(image_file)
+    else:
+        values = {"image_width": None, "image_height": None,
+                  "image_format": "", "image_size": None,
+                  "image_placeholder": ""}
+    for name, value in values.items():
+        setattr(post, name, value)
+
+
+def thumbnail_file(image):
+    """Файл миниатюры картинки без обращения к хранилищу.
+
+    Имя строится так же, как в sorl.thumbnail.base.ThumbnailBackend.
+    get_thumbnail, только без чтения исходного файла.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(THUMBNAIL_OPTIONS)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault("format", backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, THUMBNAIL_GEOMETRY,
+                                           options)
+    return ImageFile(name, default.storage)
+
+
+def prefetch_thumbnails(posts):
+    """Находит миниатюры всех постов страницы разом.
+
+    Вместо запроса к хранилищу sorl на каждый {% thumbnail %} записи
+    читаются из кэша одним get_many, а недостающие — одним запросом
+    к KVStore. Готовая миниатюра кладётся в post.thumbnail. Если записи
+    нет, миниатюра не создаётся в запросе: пост возвращается в очередь
+    thumbnail_worker, а страница показывает заглушку.
+
+    Рассчитано на хранилище sorl по умолчанию (cached_db_kvstore).
+    """
+    posts = [post for post in posts if post.thumbnail_ready and post.image]
+    if not posts:
+        return
+    keys = {post.pk: add_prefix(thumbnail_file(post.image).key)
+            for post in posts}
+    kvstore = default.kvstore
+    values = {key: value
+              for key, value in kvstore.cache.get_many(keys.values()).items()
+              if isinstance(value, str)}
+    missing = set(keys.values()) - set(values)
+    if missing:
+        found = dict(KVStore.objects.filter(key__in=missing).values_list(
+            "key", "value"))
+        kvstore.cache.set_many(found, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(found)
+    lost = []
+    for post in posts:
+        value = values.get(keys[post.pk])
+        if value is None:
+            # новая версия карточки, как в render_thumbnail: иначе кэш
+            # карточек и страниц показывал бы ссылку на пропавший файл
+            post.thumbnail_ready = False
+            post.cache_version += 1
+            lost.append(post)
+        else:
+            post.thumbnail = deserialize_image_file(value)
+    if lost:
+        Post.objects.filter(
+            pk__in=[post.pk for post in lost], thumbnail_ready=True).update(
+            thumbnail_ready=False, cache_version=F("cache_version") + 1)
+        feeds_changed(*[post.group_id for post in lost])
+
+
+def pending_posts():
+    """Очередь обработчика: посты с картинкой, миниатюра которой не готова."""
+    return Post.objects.filter(thumbnail_ready=False).exclude(
+        image="").exclude(image__isnull=True)
+
+
+def render_thumbnail(post_id):
+    post = Post.objects.filter(pk=post_id).only(
+        "image", "group", "image_width").first()
+    if post is None or not post.image:
+        return False
+    metadata = {}
+    try:
+        get_thumbnail(post.image, THUMBNAIL_GEOMETRY, **THUMBNAIL_OPTIONS)
+        if post.image_width is None:
+            # картинки, загруженные не через PostForm (например,
+            # seed_data), описываются здесь
+            with post.image.open("rb") as image_file:
+                metadata = image_metadata(image_file)
+    except Exception:
+        logger.exception("Не удалось создать миниатюру поста %s", post_id)
+        return False
+    # если картинку успели заменить, флаг остаётся за новой задачей
+    updated = Post.objects.filter(
+        pk=post_id, image=post.image.name, thumbnail_ready=False).update(
+        thumbnail_ready=True, cache_version=F("cache_version") + 1,
+        **metadata)
+    if updated:
+        feeds_changed(post.group_id)
+    return bool(updated)
+
+
+def setup_worker():
+    # при запуске через spawn процесс начинается с чистого интерпретатора
+    django.setup()
+
+
+def render_pending(post_ids, processes=None):
+    """Готовит миниатюры в пуле процессов, возвращает число готовых."""
+    if not post_ids:
+        return 0
+    if processes == 1:
+        return sum(map(render_thumbnail, post_ids))
+    # дочерние процессы не должны делить соединение с базой с родителем
+    connections.close_all()
+    with Pool(processes, initializer=setup_worker) as pool:
+        return sum(pool.map(render_thumbnail, post_ids))
@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.db.models import Q
+
+from .models import FEED_FIELDS, Follow, Post, TimelineEntry, UserStats
+
+
+def is_celebrity(author_id):
+    # у популярных авторов посты не раскладываются по лентам подписчиков,
+    # а подтягиваются при чтении
+    return UserStats.objects.filter(user_id=author_id,
+                                    timeline_pull=True).exists()
+
+
+def mark_celebrities(*author_ids):
+    """Переводит авторов с подписчиками сверх лимита на чтение при запросе."""
+    authors = UserStats.objects.filter(
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT,
+        timeline_pull=False)
+    if author_ids:
+        authors = authors.filter(user_id__in=author_ids)
+    return authors.update(timeline_pull=True)
+
+
+def fan_out(post):
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list("user_id", flat=True)
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id,
+                       post_id=post.id,
+                       author_id=post.author_id,
+                       pub_date=post.pub_date)
+         for user_id in followers.iterator()],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def recent_posts(author_id):
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        "-pub_date", "-id").values_list("id", "pub_date")
+    return list(posts[:settings.TIMELINE_BACKFILL_SIZE])
+
+
+def backfill(follow):
+    if is_celebrity(follow.author_id):
+        return
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=follow.user_id,
+                       post_id=post_id,
+                       author_id=follow.author_id,
+                       pub_date=pub_date)
+         for post_id, pub_date in recent_posts(follow.author_id)],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def backfill_followers(author_id):
+    """Раскладывает посты автора, который перестал быть популярным.
+
+    Пока подписчиков было больше лимита, его посты в TimelineEntry не
+    попадали, а теперь follow_feed читает только эту таблицу.
+    """
+    posts = recent_posts(author_id)
+    followers = Follow.objects.filter(
+        author_id=author_id).values_list("user_id", flat=True)
+    for user_id in followers.iterator():
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id,
+                           post_id=post_id,
+                           author_id=author_id,
+                           pub_date=pub_date)
+             for post_id, pub_date in posts],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+
+def release_celebrities():
+    """Возвращает в ленты авторов, у которых подписчиков стало меньше.
+
+    Запас между TIMELINE_FANOUT_LIMIT и TIMELINE_FANOUT_RESUME не даёт
+    раскладывать посты заново при каждом колебании числа подписчиков.
+    Флаг снимается до раскладки: новые посты уже попадают в ленты, а
+    подписки, созданные во время раскладки, заполняются сами.
+    """
+    authors = UserStats.objects.filter(
+        timeline_pull=True,
+        followers_count__lte=settings.TIMELINE_FANOUT_RESUME)
+    released = 0
+    for author_id in authors.values_list("user_id", flat=True).iterator():
+        UserStats.objects.filter(user_id=author_id).update(
+            timeline_pull=False)
+        backfill_followers(author_id)
+        released += 1
+    return released
+
+
+def remove(follow):
+    TimelineEntry.objects.filter(user_id=follow.user_id,
+                                 author_id=follow.author_id).delete()
+
+
+def celebrities_followed_by(user):
+    follows = Follow.objects.filter(user=user,
+                                    author__stats__timeline_pull=True)
+    return list(follows.values_list("author_id", flat=True))
+
+
+def follow_feed(user):
+    """Возвращает ленту подписок и порядок сортировки для пагинации.
+
+    Обычно это чтение диапазона по индексу из таблицы TimelineEntry;
+    если среди подписок есть популярные авторы, их посты добавляются
+    к ленте при чтении.
+    """
+    celebrities = celebrities_followed_by(user)
+    entries = TimelineEntry.objects.filter(user=user)
+    if not celebrities:
+        entries = entries.select_related(
+            "post__author", "post__group").only(
+            "pub_date", "post", *[f"post__{name}" for name in FEED_FIELDS])
+        return entries, ("-pub_date", "-post_id")
+    post_list = Post.objects.feed().filter(
+        Q(pk__in=entries.values("post_id")) | Q(author__in=celebrities))
+    return post_list, ("-pub_date", "-id")
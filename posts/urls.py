@@ -7,6 +7,7 @@ urlpatterns = [
     path("", views.index, name="index"),
     path("group/<slug:slug>", views.group_posts, name="group"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search, name="search"),
     path("<str:username>/follow/", views.profile_follow,
          name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow,
@@ -19,6 +20,8 @@ urlpatterns = [
         views.post_edit,
         name="post_edit"
     ),
+    path("<str:username>/<int:post_id>/comments/", views.post_comments,
+         name="post_comments"),
     path("<str:username>/<int:post_id>/comment", views.add_comment,
          name="add_comment"),
 ]
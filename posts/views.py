@@ -1,22 +1,118 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.contrib.flatpages import views as flatpages_views
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Max, Min
+from django.http import Http404, JsonResponse
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
 
+from users.cache import get_user_by_username
 from .forms import PostForm, CommentForm
-from .models import Post, Group, Follow
+from . import instrumentation, timeline
+from .cache import (author_generation_name, feed_count, flatpage_key,
+                    get_generation, get_or_compute, group_generation_name,
+                    group_id_for_slug, make_etag)
+from .search import search_posts
+from .models import Post, Group, Follow, TimelineEntry
+from .paginators import CursorPaginator
+from .stats import get_stats
+from .thumbnails import IMAGE_METADATA_FIELDS, prefetch_thumbnails
 
 
 User = get_user_model()
 
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+COMMENTS_ORDERING = ("-created", "-id")
 
+
+def paginate(request, post_list, ordering=("-pub_date", "-id"), count=None):
+    cursor_paginator = CursorPaginator(post_list, POSTS_PER_PAGE, ordering)
+    cursor = request.GET.get("cursor")
+    if cursor:
+        return cursor_paginator, cursor_paginator.get_page(cursor)
+    paginator = Paginator(post_list.order_by(*ordering), POSTS_PER_PAGE)
+    if count is not None:
+        # count у Paginator — cached_property, готовое значение избавляет
+        # от SELECT COUNT(*) по всей ленте
+        paginator.count = count
+    page = paginator.get_page(request.GET.get("page"))
+    return paginator, cursor_paginator.add_cursors(page)
+
+
+def get_author_or_404(username):
+    # имя из адреса проверяется по кэшу users.cache, в том числе
+    # несуществующие имена
+    author = get_user_by_username(username)
+    if author is None:
+        raise Http404("Пользователь не найден")
+    return author
+
+
+# ETag считается без рендера: по поколениям из posts.cache и версиям
+# постов, которые увеличиваются в posts.signals; при совпадении с
+# If-None-Match condition отвечает 304
+def index_etag(request):
+    return make_etag(request, get_generation("posts"))
+
+
+def group_etag(request, slug):
+    group_id = group_id_for_slug(slug)
+    if not group_id:
+        return None
+    return make_etag(request,
+                     get_generation(group_generation_name(group_id)))
+
+
+def profile_etag(request, username):
+    author = get_user_by_username(username)
+    if author is None:
+        return None
+    return make_etag(request, get_generation("posts"),
+                     get_generation(author_generation_name(author.pk)))
+
+
+def post_etag(request, username, post_id):
+    author = get_user_by_username(username)
+    if author is None:
+        return None
+    cache_version = Post.objects.filter(
+        pk=post_id, author_id=author.pk).values_list(
+        "cache_version", flat=True).first()
+    if cache_version is None:
+        return None
+    return make_etag(request, cache_version,
+                     get_generation(author_generation_name(author.pk)))
+
+
+def follow_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    return make_etag(request, get_generation("posts"),
+                     get_generation(author_generation_name(request.user.pk)))
+
+
+def estimate_post_count():
+    # id постов почти без пропусков, а MIN/MAX читаются из первичного ключа
+    span = Post.objects.aggregate(first=Min("id"), last=Max("id"))
+    return span["last"] - span["first"] + 1
+
+
+@condition(etag_func=index_etag)
 def index(request):
-    post_list = Post.objects.select_related(
-        'author').order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10)
+    post_list = Post.objects.feed()
+    count = feed_count("feed-count:posts", post_list, estimate_post_count)
+    paginator, page = paginate(request, post_list, count=count)
+    prefetch_thumbnails(page)
     page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
     return render(
         request,
         "index.html",
@@ -26,12 +122,13 @@ def index(request):
     )
 
 
+@condition(etag_func=group_etag)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all().order_by("-pub_date")
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    post_list = group.posts.feed()
+    count = feed_count(f"feed-count:group:{group.id}", post_list)
+    paginator, page = paginate(request, post_list, count=count)
+    prefetch_thumbnails(page)
     return render(
         request,
         "group.html",
@@ -41,6 +138,20 @@ def group_posts(request, slug):
     )
 
 
+def search(request):
+    query = request.GET.get("q", "").strip()
+    post_list = search_posts(query) if query else Post.objects.none()
+    paginator = Paginator(post_list, POSTS_PER_PAGE)
+    page = paginator.get_page(request.GET.get("page"))
+    prefetch_thumbnails(page)
+    return render(request,
+                  "search.html",
+                  {"page": page,
+                   "paginator": paginator,
+                   "query": query,
+                   "extra_query": urlencode({"q": query}) + "&"})
+
+
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -52,15 +163,14 @@ def new_post(request):
     return render(request, "new_post.html", {"form": form})
 
 
+@condition(etag_func=profile_etag)
 def profile(request, username):
-    profile = get_object_or_404(User, username=username)
-    post_list = profile.posts.all().order_by("-pub_date")
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-    posts_count = post_list.count()
-    num_of_follow = profile.follower.count()
-    num_of_followers = profile.following.count()
+    profile = get_author_or_404(username)
+    stats = get_stats(profile)
+    post_list = profile.posts.feed()
+    paginator, page = paginate(request, post_list,
+                               count=stats.posts_count)
+    prefetch_thumbnails(page)
     following = False
     if (request.user.is_authenticated and
             request.user.follower.filter(author=profile.id).exists()):
@@ -68,37 +178,61 @@ def profile(request, username):
     return render(request, "profile.html",
                   {"page": page,
                    "paginator": paginator,
-                   "posts_count": posts_count,
+                   "posts_count": stats.posts_count,
                    "profile": profile,
                    "following": following,
-                   "num_of_follow": num_of_follow,
-                   "num_of_followers": num_of_followers,
+                   "num_of_follow": stats.following_count,
+                   "num_of_followers": stats.followers_count,
                    "current_user": request.user.username
                    }
                   )
 
 
+@condition(etag_func=post_etag)
 def post_view(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    posts_count = post_list.count()
-    post = get_object_or_404(Post, pk=post_id)
+    # пост, автор, группа и счётчики автора одним запросом;
+    # пост чужого автора по этому адресу не отдаём
+    author = get_author_or_404(username)
+    post = get_object_or_404(
+        Post.objects.select_related("author", "group", "author__stats"),
+        pk=post_id, author_id=author.pk)
+    author = post.author
+    stats = get_stats(author)
+    prefetch_thumbnails([post])
     form = CommentForm()
-    comments = post.comments.all().order_by("-created")
-    num_of_follow = author.follower.count()
-    num_of_followers = author.following.count()
+    # первая порция комментариев, остальные подгружает post_comments
+    comments = post.comments.select_related("author").order_by(
+        *COMMENTS_ORDERING)[:COMMENTS_PER_PAGE]
+    next_cursor = None
+    if post.comment_count > COMMENTS_PER_PAGE and comments:
+        paginator = CursorPaginator(post.comments.all(), COMMENTS_PER_PAGE,
+                                    COMMENTS_ORDERING)
+        next_cursor = paginator.cursor_after(comments[len(comments) - 1])
     return render(request, "post.html",
-                  {"posts_count": posts_count,
+                  {"posts_count": stats.posts_count,
                    "author": author,
                    "post": post,
                    "form": form,
                    "items": comments,
-                   "num_of_follow": num_of_follow,
-                   "num_of_followers": num_of_followers,
+                   "next_cursor": next_cursor,
+                   "num_of_follow": stats.following_count,
+                   "num_of_followers": stats.followers_count,
                    }
                   )
 
 
+def post_comments(request, username, post_id):
+    post = get_object_or_404(Post.objects.select_related("author"),
+                             pk=post_id, author__username=username)
+    paginator = CursorPaginator(post.comments.select_related("author"),
+                                COMMENTS_PER_PAGE, COMMENTS_ORDERING)
+    page = paginator.get_page(request.GET.get("cursor"))
+    return render(request, "includes/comment_list.html",
+                  {"post": post,
+                   "items": page,
+                   "next_cursor": page.next_cursor})
+
+
 def post_edit(request, username, post_id):
     if request.user.username != username:
         return redirect(reverse("post", args=[username, post_id]))
@@ -106,7 +240,15 @@ def post_edit(request, username, post_id):
     form = PostForm(request.POST or None, files=request.FILES or None,
                     instance=edit_post)
     if form.is_valid():
-        edit_post.save()
+        # счётчики вроде comment_count обновляются отдельно через F(),
+        # поэтому сохраняем только поля формы
+        update_fields = list(PostForm.Meta.fields)
+        if "image" in form.changed_data:
+            # новую миниатюру подготовит thumbnail_worker
+            edit_post.thumbnail_ready = False
+            update_fields += ["thumbnail_ready", *IMAGE_METADATA_FIELDS]
+        edit_post = form.save(commit=False)
+        edit_post.save(update_fields=update_fields)
         return redirect("post", username=username, post_id=post_id)
     form = PostForm(initial={
         "text": edit_post.text,
@@ -120,6 +262,36 @@ def post_edit(request, username, post_id):
                                              })
 
 
+def flatpage(request, url):
+    """django.contrib.flatpages.views.flatpage с кэшем.
+
+    Страница из базы кэшируется для всех, готовый ответ — только для
+    анонимных посетителей, так как шапка зависит от пользователя.
+    """
+    if not url.startswith("/"):
+        url = "/" + url
+    site_id = get_current_site(request).id
+    key = flatpage_key(site_id, url)
+    anonymous = not request.user.is_authenticated
+    if anonymous:
+        response = cache.get(f"{key}:response")
+        if response is not None:
+            return response
+    page = get_or_compute(
+        key,
+        lambda: FlatPage.objects.filter(url=url,
+                                        sites=site_id).first() or False,
+        settings.FLATPAGE_CACHE_TIMEOUT)
+    if page is False:
+        # 404 или редирект на адрес со слэшем
+        return flatpages_views.flatpage(request, url)
+    response = flatpages_views.render_flatpage(request, page)
+    if anonymous and response.status_code == 200 and not response.cookies:
+        cache.set(f"{key}:response", response,
+                  settings.FLATPAGE_CACHE_TIMEOUT)
+    return response
+
+
 def page_not_found(request, exception):
     return render(
         request,
@@ -139,21 +311,23 @@ def add_comment(request, username, post_id):
     if form.is_valid():
         created_comment = form.save(commit=False)
         created_comment.author = request.user
-        created_comment.post = get_object_or_404(Post, pk=post_id)
+        created_comment.post = get_object_or_404(
+            Post, pk=post_id, author_id=get_author_or_404(username).pk)
         created_comment.save()
         return redirect("post", post_id=post_id, username=username)
     return redirect("post", post_id=post_id, username=username)
 
 
 @login_required
+@condition(etag_func=follow_etag)
 def follow_index(request):
-    user_follows = Follow.objects.select_related(
-        'author').filter(user=request.user).values_list("author")
-    post_list = Post.objects.filter(
-        author__in=user_follows).order_by("-pub_date")
-    paginator = Paginator(post_list, 10)
+    post_list, ordering = timeline.follow_feed(request.user)
+    count = feed_count(f"feed-count:follow:{request.user.id}", post_list)
+    paginator, page = paginate(request, post_list, ordering, count)
+    if post_list.model is TimelineEntry:
+        page.object_list = [entry.post for entry in page.object_list]
+    prefetch_thumbnails(page)
     page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
     return render(request,
                   "follow.html",
                   {"page": page,
@@ -166,7 +340,7 @@ def profile_follow(request, username):
     if request.user.username != username:
         Follow.objects.get_or_create(
             user=request.user,
-            author=get_object_or_404(User, username=username)
+            author=get_author_or_404(username)
         )
     return redirect("profile", username=username)
 
@@ -175,7 +349,12 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     subscribe = Follow.objects.filter(
         user=request.user,
-        author=get_object_or_404(User, username=username)
+        author=get_author_or_404(username)
     )
     subscribe.delete()
     return redirect("profile", username=username)
+
+
+@staff_member_required
+def view_stats(request):
+    return JsonResponse(instrumentation.view_stats())
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+
+User = get_user_model()
+
+# хэш пароля в кэш не попадает: вместо него хранится хэш для проверки
+# сессии, а пароль загружается из базы при обращении (check_password)
+CACHED_FIELDS = tuple(field.attname for field in User._meta.concrete_fields
+                      if field.name != "password")
+
+
+def user_cache_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, который берёт пользователя сессии из кэша.
+
+    Запись удаляется в users.signals при сохранении и удалении
+    пользователя (смена пароля, правка в админке) и при выходе.
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        cached = cache.get(key)
+        if cached is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, {
+                "fields": [getattr(user, name) for name in CACHED_FIELDS],
+                "session_hash": user.get_session_auth_hash(),
+            }, settings.USER_CACHE_TIMEOUT)
+        else:
+            user = User.from_db(DEFAULT_DB_ALIAS, CACHED_FIELDS,
+                                cached["fields"])
+            user.get_session_auth_hash = cached_session_hash(
+                user, cached["session_hash"])
+        return user if self.user_can_authenticate(user) else None
+
+
+def cached_session_hash(user, session_hash):
+    # django.contrib.auth.get_user сверяет этот хэш с сессией; без
+    # подмены он считался бы из отложенного пароля отдельным запросом.
+    # Если пароль загружен или сменён (set_password), хэш считается
+    # заново, иначе update_session_auth_hash запомнил бы старый
+    def get_session_auth_hash():
+        if "password" in user.__dict__:
+            return type(user).get_session_auth_hash(user)
+        return session_hash
+    return get_session_auth_hash
@@ -0,0 +1,43 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+
+User = get_user_model()
+
+# поля, которых хватает страницам профиля и поста
+USER_FIELDS = ("id", "username", "first_name", "last_name")
+
+
+def username_key(username):
+    # в адрес может попасть что угодно, а ключ кэша должен быть коротким
+    # и без пробелов
+    digest = hashlib.md5(username.encode()).hexdigest()
+    return f"username:{digest}"
+
+
+def forget_username(username):
+    cache.delete(username_key(username))
+
+
+def get_user_by_username(username):
+    """Пользователь по имени из адреса или None, если такого нет.
+
+    Отсутствующие имена тоже кэшируются (на USERNAME_MISSING_TIMEOUT),
+    чтобы запросы к несуществующим профилям не доходили до базы.
+    Остальные поля пользователя отложены и загрузятся при обращении.
+    """
+    key = username_key(username)
+    fields = cache.get(key)
+    if fields is None:
+        fields = User.objects.filter(username=username).values(
+            *USER_FIELDS).first() or {}
+        timeout = (settings.USERNAME_CACHE_TIMEOUT if fields
+                   else settings.USERNAME_MISSING_TIMEOUT)
+        cache.set(key, fields, timeout)
+    if not fields:
+        return None
+    return User.from_db("default", USER_FIELDS,
+                        [fields[name] for name in USER_FIELDS])
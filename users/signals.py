@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .backends import forget_user
+from .cache import forget_username
+
+
+User = get_user_model()
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_username(sender, instance, **kwargs):
+    instance.previous_username = None
+    if instance.pk is not None:
+        instance.previous_username = User.objects.filter(
+            pk=instance.pk).values_list("username", flat=True).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_changed_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+    # новое имя могло быть закэшировано как несуществующее
+    forget_username(instance.username)
+    previous_username = getattr(instance, "previous_username", None)
+    if previous_username:
+        forget_username(previous_username)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
@@ -1,3 +1,79 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from .backends import user_cache_key
+
+
+User = get_user_model()
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "cached-auth",
+    }
+})
+class CachedAuthTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="cached_user",
+                                             password="old-password-123")
+        self.client.login(username="cached_user",
+                          password="old-password-123")
+
+    def test_session_and_user_are_read_from_cache(self):
+        self.client.get(reverse("follow_index"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("follow_index"))
+        self.assertEqual(response.context["user"], self.user)
+        for query in queries.captured_queries:
+            self.assertNotIn('FROM "django_session"', query["sql"])
+            self.assertFalse(query["sql"].startswith(
+                'SELECT "auth_user"."id", "auth_user"."password"'))
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.client.get(reverse("follow_index"))
+        self.user.set_password("new-password-456")
+        self.user.save()
+        response = self.client.get(reverse("follow_index"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_profile_edit_is_visible_at_once(self):
+        self.client.get(reverse("follow_index"))
+        self.user.first_name = "Новое имя"
+        self.user.save()
+        response = self.client.get(reverse("follow_index"))
+        self.assertEqual(response.context["user"].first_name, "Новое имя")
+
+    def test_logout_forgets_user(self):
+        self.client.get(reverse("follow_index"))
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        self.client.get(reverse("logout"))
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_password_hash_is_not_cached(self):
+        self.client.get(reverse("follow_index"))
+        cached = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn(self.user.password, repr(cached))
+        user = self.client.get(
+            reverse("follow_index")).wsgi_request.user
+        self.assertTrue(user.check_password("old-password-123"))
+
+    def test_password_change_keeps_own_session(self):
+        other = Client()
+        other.login(username="cached_user", password="old-password-123")
+        other.get(reverse("follow_index"))
+        self.client.get(reverse("follow_index"))
+        self.client.post(reverse("password_change"),
+                         {"old_password": "old-password-123",
+                          "new_password1": "new-password-456",
+                          "new_password2": "new-password-456"})
+        self.assertEqual(
+            self.client.get(reverse("follow_index")).status_code, 200)
+        self.assertEqual(
+            other.get(reverse("follow_index")).status_code, 302)
@@ -0,0 +1,395 @@
+"""Кэш в общем файле, отображённом в память (mmap).
+
+Все процессы-воркеры одного сервера открывают один файл, поэтому кэш у
+них общий: то, что закэшировал или сбросил один воркер, сразу видят
+остальные. Доступ сериализуется блокировкой flock на файл.
+
+Устройство файла:
+
+* заголовок (HEADER): число слотов, размер и заполненность области
+  данных, счётчик обращений для LRU, число живых и удалённых записей;
+* таблица слотов с открытой адресацией: хэш ключа, смещение и длина
+  записи, срок жизни и время последнего обращения;
+* область данных: ключ и pickle-значение каждой записи подряд.
+
+Новые записи дописываются в конец области данных. Когда место или
+слоты заканчиваются, самые давние по обращению записи вытесняются, а
+оставшиеся переписываются в начало области данных (уплотнение).
+Работает только на POSIX-системах (fcntl).
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import stat
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+MAGIC = b"YTMMAP01"
+# magic, слоты, удалённые записи, размер данных, занято, часы LRU, записей
+HEADER = struct.Struct("<8sIIQQQQ")
+HEADER_SIZE = 64
+# состояние, длина ключа, длина записи, хэш, смещение, срок, обращение
+SLOT = struct.Struct("<BxHIQQdQ")
+EMPTY, USED, DELETED = 0, 1, 2
+# доля занятых слотов, после которой таблица пересобирается
+MAX_LOAD = 0.75
+# после вытеснения остаётся запас, чтобы не уплотнять на каждой записи
+FREE_AFTER_EVICTION = 0.1
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                          "little")
+
+
+class MappedFile:
+    """Открытый и отображённый файл кэша, один на процесс и путь."""
+
+    def __init__(self, fd, mm):
+        self.fd = fd
+        self.mm = mm
+        self.pid = os.getpid()
+        # flock не разделяет потоки с общим дескриптором
+        self.lock = threading.RLock()
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+
+# Django создаёт свой экземпляр кэша в каждом потоке, поэтому файл
+# открывается и отображается один раз на процесс
+mapped_files = {}
+mapped_files_lock = threading.Lock()
+
+
+class MmapCache(BaseCache):
+    """Кэш Django, общий для всех процессов через файл в памяти.
+
+    LOCATION — путь к файлу, он должен принадлежать пользователю
+    процесса (ссылки не открываются); OPTIONS: SIZE — размер файла в байтах
+    (по умолчанию 64 МБ), SLOTS — число слотов (по умолчанию 65536).
+    Если файл уже создан, берутся его размеры.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._path = os.path.abspath(location)
+        self._size = int(options.get("SIZE", 64 * 1024 * 1024))
+        self._nslots = int(options.get("SLOTS", 65536))
+        self._pid = None
+        self._fd = None
+        self._mm = None
+        self._thread_lock = None
+
+    # файл и блокировки
+
+    def _open(self):
+        # после fork дескриптор общий с родителем, а flock с общего
+        # дескриптора не разделяет процессы, поэтому файл переоткрывается
+        if self._pid == os.getpid():
+            return
+        with mapped_files_lock:
+            mapped = mapped_files.get(self._path)
+            if mapped is None or mapped.pid != os.getpid():
+                if mapped is not None:
+                    mapped.close()
+                mapped = mapped_files[self._path] = self._map_file()
+        self._fd = mapped.fd
+        self._mm = mapped.mm
+        self._thread_lock = mapped.lock
+        self._load_layout()
+        self._pid = os.getpid()
+
+    def _map_file(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, 0o700, exist_ok=True)
+        # из файла читаются pickle-данные, поэтому чужой файл или
+        # подложенная ссылка равносильны выполнению чужого кода
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW,
+                     0o600)
+        try:
+            info = os.fstat(fd)
+            if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid():
+                raise PermissionError(
+                    f"Файл кэша {self._path} не принадлежит процессу")
+        except Exception:
+            os.close(fd)
+            raise
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER_SIZE or os.pread(fd, 8, 0) != MAGIC:
+                size = self._size
+                os.ftruncate(fd, size)
+                self._mm = mmap.mmap(fd, size)
+                self._init_file()
+            else:
+                self._mm = mmap.mmap(fd, size)
+        except Exception:
+            os.close(fd)
+            raise
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        return MappedFile(fd, self._mm)
+
+    def _init_file(self):
+        arena_size = self._size - HEADER_SIZE - self._nslots * SLOT.size
+        if arena_size <= 0:
+            raise ValueError("SIZE слишком мал для заданного числа SLOTS")
+        self._mm[HEADER_SIZE:HEADER_SIZE + self._nslots * SLOT.size] = (
+            bytes(self._nslots * SLOT.size))
+        HEADER.pack_into(self._mm, 0, MAGIC, self._nslots, 0, arena_size,
+                         0, 0, 0)
+
+    def _load_layout(self):
+        _, nslots, _, arena_size, _, _, _ = HEADER.unpack_from(self._mm, 0)
+        self._nslots = nslots
+        self._arena_size = arena_size
+        self._arena = HEADER_SIZE + nslots * SLOT.size
+
+    @contextmanager
+    def _locked(self):
+        self._open()
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # заголовок и слоты
+
+    def _header(self):
+        return list(HEADER.unpack_from(self._mm, 0))
+
+    def _write_header(self, header):
+        HEADER.pack_into(self._mm, 0, *header)
+
+    def _slot_position(self, index):
+        return HEADER_SIZE + index * SLOT.size
+
+    def _read_slot(self, index):
+        return SLOT.unpack_from(self._mm, self._slot_position(index))
+
+    def _write_slot(self, index, *fields):
+        SLOT.pack_into(self._mm, self._slot_position(index), *fields)
+
+    def _tick(self, header):
+        header[5] += 1
+        return header[5]
+
+    def _find(self, key, hashed):
+        """Индекс записи с ключом (или None) и первый свободный слот."""
+        index = hashed % self._nslots
+        free = None
+        for _ in range(self._nslots):
+            slot = self._read_slot(index)
+            state, key_length, _, slot_hash, offset, _, _ = slot
+            if state == EMPTY:
+                return None, index if free is None else free
+            if state == DELETED:
+                if free is None:
+                    free = index
+            elif slot_hash == hashed and key_length == len(key):
+                start = self._arena + offset
+                if self._mm[start:start + key_length] == key:
+                    return index, free
+            index = (index + 1) % self._nslots
+        return None, free
+
+    def _delete_slot(self, index, header):
+        state, key_length, length, hashed, offset, expires, access = (
+            self._read_slot(index))
+        self._write_slot(index, DELETED, key_length, length, hashed,
+                         offset, expires, access)
+        header[6] -= 1
+        header[2] += 1
+
+    def _live_slot(self, key, header):
+        """Слот живой записи; просроченная запись удаляется."""
+        index, _ = self._find(key, key_hash(key))
+        if index is None:
+            return None
+        slot = self._read_slot(index)
+        expires = slot[5]
+        if expires and expires <= time.time():
+            self._delete_slot(index, header)
+            return None
+        return index
+
+    def _read_value(self, index, header):
+        state, key_length, length, hashed, offset, expires, _ = (
+            self._read_slot(index))
+        self._write_slot(index, state, key_length, length, hashed, offset,
+                         expires, self._tick(header))
+        start = self._arena + offset + key_length
+        return bytes(self._mm[start:self._arena + offset + length])
+
+    def _store(self, key, data, expires, header):
+        length = len(key) + len(data)
+        hashed = key_hash(key)
+        index, free = self._find(key, hashed)
+        if index is not None:
+            self._delete_slot(index, header)
+            if free is None:
+                free = index
+        # слишком большие значения не кэшируются, чтобы не вытеснять всё
+        if length > self._arena_size // 2:
+            return False
+        used_slots = header[6] + header[2] + 1
+        if (header[4] + length > self._arena_size
+                or used_slots > self._nslots * MAX_LOAD):
+            self._make_room(length, header)
+            _, free = self._find(key, hashed)
+        if self._read_slot(free)[0] == DELETED:
+            header[2] -= 1
+        offset = header[4]
+        start = self._arena + offset
+        self._mm[start:start + len(key)] = key
+        self._mm[start + len(key):start + length] = data
+        self._write_slot(free, USED, len(key), length, hashed, offset,
+                         expires, self._tick(header))
+        header[4] += length
+        header[6] += 1
+        return True
+
+    def _make_room(self, needed, header):
+        """Вытесняет давние записи и уплотняет область данных."""
+        now = time.time()
+        live = []
+        for index in range(self._nslots):
+            slot = self._read_slot(index)
+            if slot[0] == USED and not (slot[5] and slot[5] <= now):
+                live.append(slot)
+        live.sort(key=lambda slot: slot[6], reverse=True)
+        budget = self._arena_size * (1 - FREE_AFTER_EVICTION) - needed
+        max_entries = int(self._nslots * MAX_LOAD / 2)
+        kept = []
+        used = 0
+        for slot in live:
+            if used + slot[2] > budget or len(kept) >= max_entries:
+                break
+            kept.append(slot)
+            used += slot[2]
+        blobs = [bytes(self._mm[self._arena + slot[4]:
+                                self._arena + slot[4] + slot[2]])
+                 for slot in kept]
+        self._mm[HEADER_SIZE:self._arena] = bytes(self._nslots * SLOT.size)
+        offset = 0
+        for slot, blob in zip(kept, blobs):
+            _, key_length, length, hashed, _, expires, access = slot
+            start = self._arena + offset
+            self._mm[start:start + length] = blob
+            index = hashed % self._nslots
+            while self._read_slot(index)[0] != EMPTY:
+                index = (index + 1) % self._nslots
+            self._write_slot(index, USED, key_length, length, hashed,
+                             offset, expires, access)
+            offset += length
+        header[2] = 0
+        header[4] = offset
+        header[6] = len(kept)
+
+    # API кэша Django
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key.encode()
+
+    def _expires(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return 0.0 if expires is None else expires
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._locked():
+            header = self._header()
+            if self._live_slot(key, header) is not None:
+                self._write_header(header)
+                return False
+            stored = self._store(key, data, self._expires(timeout), header)
+            self._write_header(header)
+            return stored
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        with self._locked():
+            header = self._header()
+            index = self._live_slot(key, header)
+            data = None
+            if index is not None:
+                data = self._read_value(index, header)
+            self._write_header(header)
+        if data is None:
+            return default
+        return pickle.loads(data)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._locked():
+            header = self._header()
+            self._store(key, data, self._expires(timeout), header)
+            self._write_header(header)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._locked():
+            header = self._header()
+            index = self._live_slot(key, header)
+            if index is not None:
+                slot = list(self._read_slot(index))
+                slot[5] = self._expires(timeout)
+                self._write_slot(index, *slot)
+            self._write_header(header)
+            return index is not None
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        with self._locked():
+            header = self._header()
+            index, _ = self._find(key, key_hash(key))
+            if index is not None:
+                self._delete_slot(index, header)
+            self._write_header(header)
+
+    def incr(self, key, delta=1, version=None):
+        # чтение и запись под одной блокировкой, поэтому увеличение
+        # атомарно для всех процессов
+        cache_key = self._key(key, version)
+        with self._locked():
+            header = self._header()
+            index = self._live_slot(cache_key, header)
+            if index is None:
+                self._write_header(header)
+                raise ValueError("Key '%s' not found" % key)
+            expires = self._read_slot(index)[5]
+            value = pickle.loads(self._read_value(index, header)) + delta
+            self._store(cache_key, pickle.dumps(value), expires, header)
+            self._write_header(header)
+            return value
+
+    def clear(self):
+        with self._locked():
+            self._size = len(self._mm)
+            self._init_file()
+            self._load_layout()
+
+    def stats(self):
+        """Число записей и заполненность области данных."""
+        with self._locked():
+            header = self._header()
+        return {"entries": header[6], "bytes": header[4],
+                "capacity": self._arena_size}
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,13 +59,25 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'posts.middleware.AnonymousPageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
+
+# сессия и пользователь авторизованного посетителя читаются из кэша,
+# а не из базы на каждом запросе
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+USER_CACHE_TIMEOUT = 60 * 15
+# имя пользователя из адреса -> id и имя для профиля и страницы поста
+USERNAME_CACHE_TIMEOUT = 60 * 60
+USERNAME_MISSING_TIMEOUT = 60
+# сколько помнить, что группы с таким slug нет (posts.cache)
+GROUP_MISSING_TIMEOUT = 60
 TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'posts.instrumentation.TimedDjangoTemplates',
         'DIRS': [TEMPLATE_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -147,8 +161,70 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 SITE_ID = 1
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# кэш в общем файле в памяти (yatube/mmap_cache.py): один на все
+# процессы-воркеры сервера; на системах без fcntl — LocMemCache.
+# Файл лежит в каталоге cache/ проекта (не в общем /tmp, где его мог бы
+# подменить другой пользователь), путь можно задать в YATUBE_CACHE_FILE.
+# Тесты (manage.py test и pytest) создают свою базу с теми же id и
+# очищают кэш, поэтому работают с собственным LocMemCache, а не с
+# файлом запущенного сайта
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if os.name == 'posix' and not TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.mmap_cache.MmapCache',
+            'LOCATION': os.environ.get(
+                'YATUBE_CACHE_FILE',
+                os.path.join(BASE_DIR, 'cache', 'yatube-cache.mmap')),
+            'OPTIONS': {
+                'SIZE': 64 * 1024 * 1024,
+                'SLOTS': 65536,
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
\ No newline at end of file
+
+# лента подписок: посты авторов, у которых подписчиков больше лимита,
+# не раскладываются по лентам, а подтягиваются при чтении
+TIMELINE_FANOUT_LIMIT = 1000
+# команда backfill_timelines возвращает автора в ленты, когда подписчиков
+# становится не больше этого числа
+TIMELINE_FANOUT_RESUME = 900
+# сколько последних постов автора добавить в ленту при подписке
+TIMELINE_BACKFILL_SIZE = 500
+
+# сколько секунд хранить главную и страницы групп для анонимных посетителей
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60 * 5
+
+# ленты длиннее этого лимита не пересчитываются на каждый запрос:
+# число записей оценивается и кэшируется на FEED_COUNT_TIMEOUT секунд
+FEED_COUNT_EXACT_LIMIT = 10000
+FEED_COUNT_TIMEOUT = 60 * 5
+
+# защита от одновременного пересчёта ключа (posts.cache.get_or_compute):
+# сколько отдавать устаревшее значение, пока его пересчитывает один
+# процесс, на сколько берётся блокировка и сколько ждать значения,
+# которого в кэше ещё нет
+CACHE_STALE_TIMEOUT = 60
+CACHE_LOCK_TIMEOUT = 30
+CACHE_WAIT_TIMEOUT = 5
+CACHE_WAIT_INTERVAL = 0.05
+
+# страницы about/terms сбрасываются из кэша сигналами FlatPage
+FLATPAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# сколько SQL-запросов может сделать страница, проверяется в posts.tests
+QUERY_BUDGETS = {
+    "index": 4,
+    "group": 5,
+    "profile": 6,
+    "post": 5,
+    "follow_index": 5,
+    "new_post": 8,
+    "add_comment": 6,
+}
@@ -17,9 +17,10 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.contrib.flatpages import views
 from django.urls import path, include
 
+from posts.views import flatpage, view_stats
+
 
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
@@ -27,19 +28,21 @@ handler500 = "posts.views.server_error"  # noqa
 
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("about/", include("django.contrib.flatpages.urls")),
+    path("about/<path:url>", flatpage,
+         name="django.contrib.flatpages.views.flatpage"),
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
-    path('about-us/', views.flatpage, {"url": "/about-us/"}, name="about"),
-    path('terms/', views.flatpage, {"url": "/terms/"}, name="terms"),
+    path('about-us/', flatpage, {"url": "/about-us/"}, name="about"),
+    path('terms/', flatpage, {"url": "/terms/"}, name="terms"),
     path('about-author/',
-         views.flatpage,
+         flatpage,
          {"url": "/about-author/"},
          name="about-author"),
     path("about-spec/",
-         views.flatpage,
+         flatpage,
          {"url": "/about-spec/"},
          name="about-spec"),
+    path("internal/stats/", view_stats, name="view_stats"),
     path("", include("posts.urls")),
 ]
 